@@ -1,96 +1,479 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
 import sys
+import time
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
 
-from parser import Parser, A_INSTRUCTION, C_INSTRUCTION, L_INSTRUCTION
-from code import Code
+from parser import Parser, Instruction, decode, iter_clean_lines, iter_instructions, parse_lines, A_INSTRUCTION, C_INSTRUCTION, L_INSTRUCTION
+from code import to_a_instruction, to_c_instruction
+import peephole
+from rom_image import to_words, write_hack, write_packed
+from source_map import SourceMap, default_map_path
 from symbol_table import SymbolTable
 
-def to_a_instruction(value: int) -> str:
-    """0vvvvvvvvvvvvvvv の16bit文字列を返す (value: 0..32767)"""
-    if not isinstance(value, int):
-        raise TypeError(f"A-instruction value must be int, got {type(value)}")
-    if not (0 <= value <= 32767):
-        raise ValueError(f"A constant out of range: {value}")
-    return "0" + format(value, "015b")
+try:
+    import numpy as np
+except ImportError:  # NumPy は任意。無ければ encode_a_bulk() は1語ずつ処理する
+    np = None
 
-def to_c_instruction(dest_mn: str, comp_mn: str, jump_mn: str) -> str:
-    return "111" + Code.comp(comp_mn) + Code.dest(dest_mn) + Code.jump(jump_mn)
+if np is not None:
+    _BIT_SHIFTS = np.arange(15, -1, -1)
 
-def assemble(asm_path: str) -> list[str]:
-    """完全版: 2パスで (LABEL) と @symbol(変数) を解決して .hack を生成する。"""
+def encode_a_bulk(values: Sequence[int]) -> list[str]:
+    """A命令の値をまとめて16bit文字列にする (to_a_instruction のバルク版)。
 
-    # --------------------
-    # Pass 1: label (L-instruction) を収集してシンボルテーブルへ
-    # --------------------
-    st = SymbolTable()
-    p1 = Parser(asm_path)
+    NumPy があれば範囲チェックとビット展開を配列演算でまとめて行う。
+    無ければ (または int64 に収まらない巨大な定数があれば) to_a_instruction を
+    1語ずつ呼ぶだけなので、どのモードでも同じ TypeError / ValueError になる。
+    """
+    if np is None or not values:
+        return [to_a_instruction(v) for v in values]
+    arr = np.asarray(values)
+    if arr.dtype.kind not in "iu":
+        # object (巨大な int) や float など: 1語ずつのチェックに任せる
+        return [to_a_instruction(v) for v in values]
+    out_of_range = (arr < 0) | (arr > 32767)
+    if out_of_range.any():
+        raise ValueError(f"A constant out of range: {values[int(out_of_range.argmax())]}")
+    bits = (arr[:, None] >> _BIT_SHIFTS) & 1
+    text = (bits.astype(np.uint8) + ord("0")).tobytes().decode("ascii")
+    return [text[i:i + 16] for i in range(0, len(text), 16)]
 
-    rom_address = 0  # A/C 命令だけを数えたときの次のROM番地
-    while p1.hasMoreLines():
-        p1.advance()
-        t = p1.instructionType()
+# C命令の行テキスト ("M=M+1" など) -> 16bit文字列 のキャッシュ。
+# コンパイラ出力は同じ C 命令行を大量に繰り返すので、2回目以降は辞書1回で済む。
+# 未知のニーモニックは to_c_instruction() が例外を投げるのでキャッシュされない。
+_C_CACHE: dict[str, str] = {}
 
-        if t == L_INSTRUCTION:
-            label = p1.symbol()  # (xxx) の xxx
+def encode_c_line(ins: Instruction) -> str:
+    """デコード済み C 命令を、行テキスト単位のキャッシュ付きでバイナリ化する。"""
+    code = _C_CACHE.get(ins.text)
+    if code is None:
+        code = to_c_instruction(ins.dest, ins.comp, ins.jump)
+        _C_CACHE[ins.text] = code
+    return code
+
+def assemble(asm_path: str, single_pass: bool = False) -> list[str]:
+    """完全版: (LABEL) と @symbol(変数) を解決して .hack を生成する。
+
+    single_pass=True なら命令列を1回だけ走査し、前方参照をあとでバックパッチする。
+    出力は2パス版とビット単位で一致する。
+    """
+    if single_pass:
+        return assemble_single_pass(asm_path)
+    return assemble_two_pass(asm_path)
+
+def _collect_labels(instructions: Iterable[Instruction], st: SymbolTable) -> None:
+    """Pass 1: label (L-instruction) を収集してシンボルテーブルへ"""
+    rom_address = 0  # A/C 命令だけを数えたときの次のROM番地
+    for ins in instructions:
+        if ins.kind == L_INSTRUCTION:
             # ラベルは "次に現れる実命令(A/C)のROMアドレス" に束縛される
-            if not st.contains(label):
-                st.addEntry(label, rom_address)
+            if not st.contains(ins.symbol):
+                st.addEntry(ins.symbol, rom_address)
             continue
 
         # A/C 命令はROMを1語消費
         rom_address += 1
 
-    # --------------------
-    # Pass 2: 実際にバイナリ化。@xxx の xxx を数値へ解決
-    # --------------------
-    p2 = Parser(asm_path)
-    out: list[str] = []
+def _encode_pass(instructions: Iterable[Instruction], st: SymbolTable) -> Iterator[str]:
+    """Pass 2: 実際にバイナリ化。@xxx の xxx を数値へ解決しながら1語ずつ返す"""
     next_address = 16
-    while p2.hasMoreLines():
-        p2.advance()
-        t = p2.instructionType()
+    for ins in instructions:
+        t = ins.kind
 
         if t == L_INSTRUCTION:
             continue  # (LABEL) はコードを出力しない
 
         if t == A_INSTRUCTION:
-            sym = p2.symbol()  # @yyy の yyy
+            sym = ins.symbol  # @yyy の yyy
 
             # @123 のような数値はそのまま
             if sym.isdigit():
-                out.append(to_a_instruction(int(sym)))
+                yield to_a_instruction(int(sym))
                 continue
 
             # @SCREEN や @LOOP や @i など: シンボル解決
             if st.contains(sym):
-                out.append(to_a_instruction(st.getAddress(sym)))
+                yield to_a_instruction(st.getAddress(sym))
                 continue
 
             # 未登録なら新しい変数として割り当て
             st.addEntry(sym, next_address)
-            out.append(to_a_instruction(next_address))
+            yield to_a_instruction(next_address)
             next_address += 1
             continue
 
         # C-instruction
-        out.append(to_c_instruction(p2.dest(), p2.comp(), p2.jump()))
+        yield encode_c_line(ins)
+
+def _resolve_pass(instructions: Iterable[Instruction], st: SymbolTable) -> list[str]:
+    """Pass 2 のバルク版: _encode_pass と同じ結果を返す。
+
+    C命令はその場でエンコードし、A命令はアドレスの解決だけ済ませて
+    最後に encode_a_bulk() でまとめてエンコードする。
+    """
+    out: list[str | None] = []
+    a_slots: list[int] = []   # A命令の out 上の位置
+    a_values: list[int] = []  # その値
+    next_address = 16
+    for ins in instructions:
+        t = ins.kind
+
+        if t == L_INSTRUCTION:
+            continue
+
+        if t == A_INSTRUCTION:
+            sym = ins.symbol
+            if sym.isdigit():
+                value = int(sym)
+            elif st.contains(sym):
+                value = st.getAddress(sym)
+            else:
+                st.addEntry(sym, next_address)
+                value = next_address
+                next_address += 1
+            a_slots.append(len(out))
+            a_values.append(value)
+            out.append(None)
+            continue
 
+        out.append(encode_c_line(ins))
+
+    for index, code in zip(a_slots, encode_a_bulk(a_values)):
+        out[index] = code
     return out
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 assembler.py Prog.asm")
-        sys.exit(1)
+def assemble_two_pass(asm_path: str) -> list[str]:
+    """2パス版: Pass 1 でラベルを集め、Pass 2 でバイナリ化する。
+
+    ファイルの読み込みとデコードは Parser で1回だけ行い、両パスとも
+    デコード済みの Instruction を回す。
+    """
+    return _assemble_instructions(Parser(asm_path).instructions)
+
+def _assemble_instructions(instructions: list[Instruction]) -> list[str]:
+    st = SymbolTable()
+    _collect_labels(instructions, st)
+    return _resolve_pass(instructions, st)
+
+def assemble_lines(source: str | Iterable[str]) -> array:
+    """メモリ上のアセンブリをアセンブルし、array('H') の機械語を返す。
+
+    source はソース全体の文字列でも、行の列 (例: CodeWriter の sink が受け取るチャンクを集めたもの) でもよい。
+    .asm ファイルを書いて読み直す必要がないので、VM translator の出力を
+    そのままつなげられる。
+    """
+    return to_words(_assemble_instructions(parse_lines(source)))
+
+def assemble_stream(asm_path: str) -> Iterator[str]:
+    """ストリーミング版: 16bit文字列を1語ずつ遅延して返す。
+
+    ソースはチャンク単位で2回読む (Pass 1 / Pass 2)。行リストも出力リストも
+    持たないので、メモリはシンボルテーブルの大きさにしか依存しない。
+    """
+    st = SymbolTable()
+    _collect_labels(iter_instructions(asm_path), st)
+    yield from _encode_pass(iter_instructions(asm_path), st)
+
+
+def assemble_single_pass(asm_path: str) -> list[str]:
+    """1パス版: 未解決の @symbol を記録しておき、最後にまとめてバックパッチする。"""
+    st = SymbolTable()
+
+    out: list[str | None] = []
+    a_slots: list[int] = []           # A命令の out 上の位置
+    a_values: list[int] = []          # その値 (未解決なら -1)
+    fixups: list[tuple[int, str]] = []  # (a_values の位置, シンボル)
+    for ins in Parser(asm_path):
+        t = ins.kind
+
+        if t == L_INSTRUCTION:
+            # ラベルは "次に現れる実命令(A/C)のROMアドレス" = 現在の出力長
+            if not st.contains(ins.symbol):
+                st.addEntry(ins.symbol, len(out))
+            continue
+
+        if t == A_INSTRUCTION:
+            sym = ins.symbol
+            if sym.isdigit():
+                value = int(sym)
+            elif st.contains(sym):
+                # 定義済みシンボル or すでに現れたラベル
+                value = st.getAddress(sym)
+            else:
+                # 前方参照のラベルか変数かはまだ分からないので保留
+                fixups.append((len(a_values), sym))
+                value = -1
+            a_slots.append(len(out))
+            a_values.append(value)
+            out.append(None)
+            continue
+
+        out.append(encode_c_line(ins))
+
+    # --------------------
+    # Backpatch: 最後までラベルとして現れなかったものは変数 (出現順に16番地から)
+    # --------------------
+    next_address = 16
+    for index, sym in fixups:
+        if not st.contains(sym):
+            st.addEntry(sym, next_address)
+            next_address += 1
+        a_values[index] = st.getAddress(sym)
+
+    # A命令はまとめてエンコード
+    for index, code in zip(a_slots, encode_a_bulk(a_values)):
+        out[index] = code
+    return out
+
+# --------------------
+# Incremental: ラベル区切りの領域ごとに結果をディスクへキャッシュする
+# --------------------
+# キャッシュ形式が変わったら上げる (古いキャッシュは丸ごと捨てられる)
+INCREMENTAL_CACHE_VERSION = 1
+
+def default_cache_path(asm_path: str) -> str:
+    return os.path.splitext(asm_path)[0] + ".asmcache"
+
+def _split_regions(lines: Iterable[str]) -> list[list[str]]:
+    """クリーン済みの行を (LABEL) の直前で区切る。先頭の領域だけはラベルを持たない。"""
+    regions: list[list[str]] = [[]]
+    for line in lines:
+        if line.startswith("(") and line.endswith(")"):
+            regions.append([])
+        regions[-1].append(line)
+    return regions
+
+def _scan_region(instructions: list[Instruction]) -> dict:
+    """領域の先頭ラベル・語数・参照する非数値シンボル (初出順・重複なし) を調べる。"""
+    label = None
+    if instructions and instructions[0].kind == L_INSTRUCTION:
+        label = instructions[0].symbol
+    count = 0
+    symbols: dict[str, None] = {}
+    for ins in instructions:
+        if ins.kind == L_INSTRUCTION:
+            continue
+        count += 1
+        if ins.kind == A_INSTRUCTION and not ins.symbol.isdigit():
+            symbols.setdefault(ins.symbol)
+    return {"label": label, "count": count, "symbols": list(symbols)}
+
+def assemble_incremental(asm_path: str, cache_path: str | None = None) -> list[str]:
+    """内容ハッシュをキーにしたキャッシュを使うアセンブル。出力は assemble() と一致する。
+
+    ソースを (LABEL) ごとの領域に分け、領域テキストのハッシュごとに
+    語数・参照シンボル・エンコード結果・そのとき解決したアドレスを保存する。
+    次回は変更された領域だけをデコードし、参照先のアドレスがずれていない
+    領域はエンコード結果をそのまま使う。
+    """
+    if cache_path is None:
+        cache_path = default_cache_path(asm_path)
+
+    data: dict = {}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if not isinstance(data, dict) or data.get("version") != INCREMENTAL_CACHE_VERSION:
+        data = {}  # 無い・壊れている・古い キャッシュは使わない
+    cached: dict[str, dict] = data.get("regions", {})
+
+    # 変更のない領域はデコードせず、キャッシュの語数・シンボル一覧だけを使う
+    regions: list[tuple[str, dict, list[str]]] = []
+    for lines in _split_regions(iter_clean_lines(asm_path)):
+        key = hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
+        entry = cached.get(key)
+        if entry is None:
+            entry = _scan_region([decode(line) for line in lines])
+        regions.append((key, entry, lines))
+
+    # Pass 1 相当: 各領域の語数からラベルのアドレスを決める
+    st = SymbolTable()
+    labels: dict[str, int] = {}
+    rom_address = 0
+    for key, entry, lines in regions:
+        label = entry["label"]
+        if label is not None and not st.contains(label):
+            st.addEntry(label, rom_address)
+            labels[label] = rom_address
+        rom_address += entry["count"]
+
+    # 変数は初出順に16番地から (領域ごとの初出順を並べれば全体の初出順になる)
+    variables: dict[str, int] = {}
+    next_address = 16
+    for key, entry, lines in regions:
+        for sym in entry["symbols"]:
+            if not st.contains(sym):
+                st.addEntry(sym, next_address)
+                variables[sym] = next_address
+                next_address += 1
+
+    # Pass 2 相当: 参照アドレスが前回と同じ領域はエンコード結果を再利用する
+    # (words は16文字ずつ連結した1本の文字列で持つ)
+    out: list[str] = []
+    new_cache: dict[str, dict] = {}
+    dirty = False
+    for key, entry, lines in regions:
+        deps = {sym: st.getAddress(sym) for sym in entry["symbols"]}
+        if entry.get("deps") != deps:
+            words = "".join(_encode_pass([decode(line) for line in lines], st))
+            entry = dict(entry, deps=deps, words=words)
+            dirty = True
+        words = entry["words"]
+        out.extend([words[i:i + 16] for i in range(0, len(words), 16)])
+        new_cache[key] = entry
+
+    if (dirty or new_cache.keys() != cached.keys()
+            or labels != data.get("labels") or variables != data.get("variables")):
+        with open(cache_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "version": INCREMENTAL_CACHE_VERSION,
+                "labels": labels,
+                "variables": variables,
+                "regions": new_cache,
+            }))
+
+    return out
+
+def assemble_file(asm_path: str, single_pass: bool = False, stream: bool = False,
+                  incremental: bool = False, optimize: bool = False,
+                  packed: str | None = None, source_map: bool = False) -> tuple[str, int | None]:
+    """Prog.asm をアセンブルして Prog.hack (packed なら Prog.bin) を書き、
+    (出力パス, ピープホールで削った命令数) を返す。命令数は optimize=False なら None。
+
+    source_map=True なら ROM番地 -> .asm行 (+ Prog.vmmap.json があれば .vm行) の
+    Prog.srcmap.json も書く。
+    """
+    if source_map and optimize:
+        raise ValueError("source maps are not supported together with the peephole optimizer")
+    if source_map:
+        SourceMap.build(asm_path).save(default_map_path(asm_path))
+
+    removed = None
+    if incremental:
+        machine_codes = assemble_incremental(asm_path)
+    elif optimize:
+        with open(asm_path, "r", encoding="utf-8") as f:
+            lines, removed = peephole.optimize(f)
+        machine_codes = _assemble_instructions(parse_lines(lines))
+    elif stream:
+        machine_codes = assemble_stream(asm_path)
+    else:
+        machine_codes = assemble(asm_path, single_pass=single_pass)
+
+    if packed:
+        bin_path = asm_path.replace(".asm", ".bin")
+        write_packed((int(code, 2) for code in machine_codes), bin_path, packed)
+        return bin_path, removed
 
-    asm_path = sys.argv[1]
     hack_path = asm_path.replace(".asm", ".hack")
+    write_hack(machine_codes, hack_path)
+    return hack_path, removed
+
+def collect_asm_files(inputs: list[str]) -> list[str]:
+    """ファイル / ディレクトリ (直下の *.asm) / glob パターンを .asm ファイルのリストに展開する。"""
+    files: list[str] = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files.extend(sorted(glob.glob(os.path.join(item, "*.asm"))))
+        elif glob.has_magic(item):
+            files.extend(sorted(glob.glob(item, recursive=True)))
+        else:
+            files.append(item)
 
-    machine_codes = assemble(asm_path)
+    # 重複は最初の1回だけ残す
+    return list(dict.fromkeys(files))
 
-    with open(hack_path, "w", encoding="utf-8") as f:
-        for code in machine_codes:
-            f.write(code + "\n")
+def _assemble_batch_item(job: tuple[str, dict]) -> tuple[str, str | None, int | None, float, str | None]:
+    """ワーカープロセスで1ファイル分を処理する。例外は文字列にして返す (バッチは止めない)。"""
+    asm_path, options = job
+    start = time.perf_counter()
+    try:
+        out_path, removed = assemble_file(asm_path, **options)
+        error = None
+    except Exception as e:
+        out_path = removed = None
+        error = f"{type(e).__name__}: {e}"
+    return asm_path, out_path, removed, time.perf_counter() - start, error
 
-    print("Wrote", hack_path)
+def assemble_batch(asm_files: list[str], jobs: int | None = None,
+                   **options) -> list[tuple[str, str | None, int | None, float, str | None]]:
+    """複数の .asm をワーカープールでアセンブルする。
+
+    1つのインタプリタ (ワーカー) が複数ファイルを続けて処理するので、起動コストや
+    Code テーブル・C命令キャッシュの準備はワーカーごとに1回で済む。
+    結果は (asm_path, out_path, ピープホールで削った命令数 or None, 秒数, エラー文字列 or None)
+    を入力順で返す。
+    """
+    work = [(path, options) for path in asm_files]
+    if jobs == 1 or len(work) <= 1:
+        return [_assemble_batch_item(job) for job in work]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(_assemble_batch_item, work, chunksize=4))
+
+def main():
+    ap = argparse.ArgumentParser(description="Hack assembler: Prog.asm -> Prog.hack")
+    ap.add_argument("inputs", nargs="+",
+                    help="input .asm file(s), directories or glob patterns")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--single-pass", action="store_true",
+                      help="read the source once and backpatch forward label references")
+    mode.add_argument("--stream", action="store_true",
+                      help="read the source in chunks and write the output incrementally")
+    mode.add_argument("--incremental", action="store_true",
+                      help="reuse unchanged label regions from Prog.asmcache")
+    mode.add_argument("-O", "--optimize", action="store_true",
+                      help="run the peephole optimizer on the source before encoding")
+    ap.add_argument("--source-map", action="store_true",
+                    help="also write Prog.srcmap.json (ROM address -> asm / vm source lines)")
+    ap.add_argument("--packed", choices=("little", "big"),
+                    help="write a packed binary ROM image (Prog.bin) instead of ASCII .hack")
+    ap.add_argument("-j", "--jobs", type=int, default=None,
+                    help="worker processes for batch mode (default: CPU count)")
+    args = ap.parse_args()
+    if args.source_map and args.optimize:
+        ap.error("--source-map cannot be combined with --optimize")
+
+    options = {"single_pass": args.single_pass, "stream": args.stream,
+               "incremental": args.incremental, "optimize": args.optimize,
+               "packed": args.packed, "source_map": args.source_map}
+
+    # 単一ファイル: 従来どおり
+    if len(args.inputs) == 1 and os.path.isfile(args.inputs[0]):
+        out_path, removed = assemble_file(args.inputs[0], **options)
+        if removed is not None:
+            print(f"{args.inputs[0]}: peephole removed {removed} instructions")
+        print("Wrote", out_path)
+        return
+
+    # バッチ: 失敗しても残りは続け、最後にまとめて報告する
+    asm_files = collect_asm_files(args.inputs)
+    if not asm_files:
+        print("No .asm files found")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    results = assemble_batch(asm_files, jobs=args.jobs, **options)
+    failed = 0
+    for asm_path, out_path, removed, seconds, error in results:
+        if error is None:
+            note = f", peephole removed {removed}" if removed is not None else ""
+            print(f"OK   {asm_path} -> {out_path} ({seconds * 1000:.1f} ms{note})")
+        else:
+            failed += 1
+            print(f"FAIL {asm_path} ({seconds * 1000:.1f} ms): {error}")
+
+    total = time.perf_counter() - start
+    print(f"{len(results) - failed}/{len(results)} assembled in {total:.2f} s")
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
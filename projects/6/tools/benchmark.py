@@ -0,0 +1,198 @@
+"""Assembler benchmark suite.
+
+Generates synthetic .asm programs of configurable size and instruction mix,
+times Parser, SymbolTable and assemble() separately, and writes the results
+as JSON so they can be compared against an earlier run.
+
+    python3 benchmark.py --sizes 1000 10000 30000 -o bench.json
+    python3 benchmark.py --baseline bench.json   # exit 1 on a regression
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from parser import Parser
+from symbol_table import SymbolTable
+import assembler
+
+# Typical C-instruction lines of compiler output
+C_LINES = [
+    "D=M", "D=A", "A=M", "M=D", "AM=M-1", "M=M+1", "M=M-1", "A=M-1",
+    "D=D+A", "D=D-A", "D=M-D", "M=D+M", "M=M-D", "M=-M", "M=!M", "D=D|M",
+    "D;JEQ", "D;JGT", "D;JLT", "D;JNE", "0;JMP", "MD=M+1", "AMD=D-1",
+]
+PREDEFINED = ["SP", "LCL", "ARG", "THIS", "THAT", "R13", "R14", "R15", "SCREEN", "KBD"]
+
+
+def generate_program(n_instructions: int, label_density: float = 0.05, n_variables: int = 50,
+                     comment_ratio: float = 0.1, c_ratio: float = 0.6, seed: int = 0) -> str:
+    """Return the text of a valid synthetic Hack program.
+
+    n_instructions: number of A/C instructions (must fit in 32K ROM)
+    label_density:  labels per instruction
+    n_variables:    number of distinct variables referenced
+    comment_ratio:  share of lines that are (or carry) comments / blank lines
+    c_ratio:        share of instructions that are C-instructions
+    """
+    if not (0 < n_instructions <= 32768):
+        raise ValueError(f"n_instructions must be in 1..32768: {n_instructions}")
+    rng = random.Random(seed)
+    n_labels = int(n_instructions * label_density)
+    labels = [f"LABEL_{i}" for i in range(n_labels)]
+    variables = [f"var_{i}" for i in range(n_variables)]
+
+    # Positions (instruction indices) at which each label is defined
+    label_at: dict[int, list[str]] = {}
+    for label in labels:
+        label_at.setdefault(rng.randrange(n_instructions), []).append(label)
+
+    lines: list[str] = []
+    for i in range(n_instructions):
+        for label in label_at.get(i, ()):
+            lines.append(f"({label})")
+
+        if rng.random() < c_ratio:
+            line = rng.choice(C_LINES)
+        else:
+            r = rng.random()
+            if labels and r < 0.3:
+                line = "@" + rng.choice(labels)
+            elif variables and r < 0.55:
+                line = "@" + rng.choice(variables)
+            elif r < 0.8:
+                line = "@" + rng.choice(PREDEFINED)
+            else:
+                line = f"@{rng.randrange(32768)}"
+
+        if rng.random() < comment_ratio:
+            kind = rng.randrange(3)
+            if kind == 0:
+                lines.append(f"// comment before instruction {i}")
+            elif kind == 1:
+                lines.append("")
+            else:
+                line = f"    {line}    // inline comment {i}"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def _time(fn, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {"min": min(samples), "median": statistics.median(samples)}
+
+
+def _symbol_table_workload(symbols: list[str]) -> None:
+    # The lookups pass 2 performs: contains() / getAddress() for every @symbol,
+    # addEntry() for every new one
+    st = SymbolTable()
+    next_address = 16
+    for sym in symbols:
+        if st.contains(sym):
+            st.getAddress(sym)
+        else:
+            st.addEntry(sym, next_address)
+            next_address += 1
+
+
+def run_case(size: int, repeat: int, **mix) -> dict:
+    """Benchmark one generated program. Returns timings in seconds."""
+    source = generate_program(size, **mix)
+    fd, asm_path = tempfile.mkstemp(suffix=".asm")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(source)
+
+        parser = Parser(asm_path)
+        symbols = [ins.symbol for ins in parser if ins.symbol and not ins.symbol.isdigit()]
+        return {
+            "size": size,
+            "lines": source.count("\n"),
+            "parser": _time(lambda: Parser(asm_path), repeat),
+            "symbol_table": _time(lambda: _symbol_table_workload(symbols), repeat),
+            "assemble": _time(lambda: assembler.assemble(asm_path), repeat),
+            "assemble_single_pass": _time(lambda: assembler.assemble(asm_path, single_pass=True), repeat),
+            "assemble_stream": _time(lambda: list(assembler.assemble_stream(asm_path)), repeat),
+        }
+    finally:
+        os.remove(asm_path)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Return a message for every (size, stage) that got slower than baseline * (1 + tolerance)."""
+    old = {case["size"]: case for case in baseline.get("results", [])}
+    regressions = []
+    for case in results["results"]:
+        before = old.get(case["size"])
+        if before is None:
+            continue
+        for stage, timing in case.items():
+            if not isinstance(timing, dict) or stage not in before:
+                continue
+            was, now = before[stage]["min"], timing["min"]
+            if was > 0 and now > was * (1 + tolerance):
+                regressions.append(f"size={case['size']} {stage}: {was * 1000:.2f} ms -> {now * 1000:.2f} ms")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the Hack assembler on synthetic programs")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 30000],
+                    help="instructions per generated program")
+    ap.add_argument("--label-density", type=float, default=0.05)
+    ap.add_argument("--variables", type=int, default=50)
+    ap.add_argument("--comment-ratio", type=float, default=0.1)
+    ap.add_argument("--c-ratio", type=float, default=0.6)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("-o", "--output", help="write results as JSON to this file")
+    ap.add_argument("--baseline", help="earlier JSON results to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2,
+                    help="allowed slowdown vs baseline before failing (default: 0.2 = 20%%)")
+    args = ap.parse_args()
+
+    mix = {
+        "label_density": args.label_density,
+        "n_variables": args.variables,
+        "comment_ratio": args.comment_ratio,
+        "c_ratio": args.c_ratio,
+        "seed": args.seed,
+    }
+    results = {
+        "python": platform.python_version(),
+        "numpy": assembler.np is not None,
+        "repeat": args.repeat,
+        "mix": mix,
+        "results": [],
+    }
+    for size in args.sizes:
+        case = run_case(size, args.repeat, **mix)
+        results["results"].append(case)
+        stages = "  ".join(f"{k}={v['min'] * 1000:.2f}ms" for k, v in case.items() if isinstance(v, dict))
+        print(f"size={size:6d}  {stages}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print("Wrote", args.output)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print("REGRESSION", message)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
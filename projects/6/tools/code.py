@@ -70,4 +70,15 @@ class Code:
     def jump(mnemonic: str) -> str:
         if mnemonic not in Code.JUMP:
             raise ValueError(f"Unknown jump: {mnemonic}")
-        return Code.JUMP[mnemonic]
\ No newline at end of file
+        return Code.JUMP[mnemonic]
+
+def to_a_instruction(value: int) -> str:
+    """0vvvvvvvvvvvvvvv の16bit文字列を返す (value: 0..32767)"""
+    if not isinstance(value, int):
+        raise TypeError(f"A-instruction value must be int, got {type(value)}")
+    if not (0 <= value <= 32767):
+        raise ValueError(f"A constant out of range: {value}")
+    return "0" + format(value, "015b")
+
+def to_c_instruction(dest_mn: str, comp_mn: str, jump_mn: str) -> str:
+    return "111" + Code.comp(comp_mn) + Code.dest(dest_mn) + Code.jump(jump_mn)
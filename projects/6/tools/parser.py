@@ -1,78 +1,132 @@
+from collections.abc import Iterable, Iterator
+
 A_INSTRUCTION = "A_INSTRUCTION"
 C_INSTRUCTION = "C_INSTRUCTION"
 L_INSTRUCTION = "L_INSTRUCTION"  # 基本版では基本使わないが、形だけ用意
 
+class Instruction:
+    """1行をデコードした結果。Parser が各行につき1回だけ作る。
+
+    kind:   A_INSTRUCTION / C_INSTRUCTION / L_INSTRUCTION
+    symbol: @xxx / (xxx) の xxx (C命令なら "")
+    dest, comp, jump: C命令 dest=comp;jump の各部分 (A/L命令なら "")
+    text:   コメント・空白を除いた元の行
+    """
+
+    __slots__ = ("kind", "symbol", "dest", "comp", "jump", "text")
+
+    def __init__(self, kind: str, symbol: str, dest: str, comp: str, jump: str, text: str):
+        self.kind = kind
+        self.symbol = symbol
+        self.dest = dest
+        self.comp = comp
+        self.jump = jump
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"Instruction({self.kind}, {self.text!r})"
+
+def decode(line: str) -> Instruction:
+    """クリーン済みの1行を Instruction にデコードする。"""
+    if line.startswith("@"):
+        return Instruction(A_INSTRUCTION, line[1:], "", "", "", line)
+    if line.startswith("(") and line.endswith(")"):
+        return Instruction(L_INSTRUCTION, line[1:-1], "", "", "", line)
+
+    # C命令 dest=comp;jump (dest / jump は省略可)
+    rest = line
+    dest = ""
+    if "=" in rest:
+        dest, rest = rest.split("=", 1)
+        dest = dest.strip()
+    jump = ""
+    if ";" in rest:
+        rest, jump = rest.split(";", 1)
+        jump = jump.strip()
+    return Instruction(C_INSTRUCTION, "", dest, rest.strip(), jump, line)
+
+# iter_instructions() が1回に読む文字数
+READ_CHUNK_SIZE = 1 << 16
+
+def clean_lines(lines: Iterable[str]) -> Iterator[str]:
+    """コメント・空白を除き、空でない行だけを返す。"""
+    for line in lines:
+        line = line.split("//", 1)[0].strip()
+        if line:
+            yield line
+
+def iter_clean_lines(asm_path: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[str]:
+    """ソースを chunk_size 文字ずつ読み、コメント・空白を除いた行を1つずつ返す。"""
+    with open(asm_path, "r", encoding="utf-8") as f:
+        tail = ""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            lines = (tail + chunk).split("\n")
+            tail = lines.pop()  # 行の途中で切れているかもしれない最後の断片
+            yield from clean_lines(lines)
+        yield from clean_lines([tail])
+
+def parse_lines(source: str | Iterable[str]) -> list[Instruction]:
+    """メモリ上のソース (文字列 or 行の列) をデコードする。ファイルを介さない版。"""
+    if isinstance(source, str):
+        source = source.split("\n")
+    return [decode(line) for line in clean_lines(source)]
+
+def iter_instructions(asm_path: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Instruction]:
+    """Instruction を1つずつ遅延して返す。
+
+    行全体をリストに持たないので、巨大な .asm でもメモリは一定。
+    """
+    for line in iter_clean_lines(asm_path, chunk_size):
+        yield decode(line)
+
 class Parser:
     def __init__(self, asm_path: str):
-        with open(asm_path, "r", encoding="utf-8") as f:
-            raw_lines = f.readlines()
-        self.lines = self._clean(raw_lines)
+        self.instructions = list(iter_instructions(asm_path))
         self.current_index = -1
+        self.current = None
         self.current_line = None
 
-    def _clean(self, raw_lines):
-        out = []
-        for line in raw_lines:
-            line = line.split("//", 1)[0].strip()
-            if line:
-                out.append(line)
-        return out
+    def __iter__(self):
+        """デコード済みの Instruction を先頭から順に返す (何度でも回せる)。"""
+        return iter(self.instructions)
 
     def hasMoreLines(self) -> bool:
-        return self.current_index + 1 < len(self.lines)
+        return self.current_index + 1 < len(self.instructions)
 
     def advance(self) -> None:
         self.current_index += 1
-        self.current_line = self.lines[self.current_index]
+        self.current = self.instructions[self.current_index]
+        self.current_line = self.current.text
 
     def instructionType(self) -> str:
-        line = self.current_line
-        if line.startswith("@"):
-            return A_INSTRUCTION
-        if line.startswith("(") and line.endswith(")"):
-            return L_INSTRUCTION
-        return C_INSTRUCTION
+        return self.current.kind
 
     def symbol(self) -> str:
         """
         A命令なら @xxx の xxx を返す。
         L命令なら (xxx) の xxx を返す。
         """
-        t = self.instructionType()
-        line = self.current_line
-        if t == A_INSTRUCTION:
-            return line[1:]
-        if t == L_INSTRUCTION:
-            return line[1:-1]
-        raise ValueError("symbol() called on non A/L INSTRUCTION")
+        if self.current.kind == C_INSTRUCTION:
+            raise ValueError("symbol() called on non A/L INSTRUCTION")
+        return self.current.symbol
 
     def dest(self) -> str:
         """
         C命令 dest=comp;jump の dest を返す（無ければ ""）。
         """
-        line = self.current_line
-        if "=" in line:
-            return line.split("=", 1)[0].strip()
-        return ""
+        return self.current.dest
 
     def comp(self) -> str:
         """
         C命令 dest=comp;jump の comp を返す。
         """
-        line = self.current_line
-        # dest を除去
-        if "=" in line:
-            line = line.split("=", 1)[1]
-        # jump を除去
-        if ";" in line:
-            line = line.split(";", 1)[0]
-        return line.strip()
+        return self.current.comp
 
     def jump(self) -> str:
         """
         C命令 dest=comp;jump の jump を返す（無ければ ""）。
         """
-        line = self.current_line
-        if ";" in line:
-            return line.split(";", 1)[1].strip()
-        return ""
\ No newline at end of file
+        return self.current.jump
@@ -0,0 +1,179 @@
+"""Peephole optimizer for Hack assembly.
+
+Runs on assembly text before encoding and removes instructions that cannot
+change the result:
+
+- redundant A loads: `@X` when A already holds X, and `@SP / A=M-1` style
+  reloads when A already holds that stack address
+- `M=M+1` immediately followed by `M=M-1` (or the reverse) on the same address
+- redundant `D=A` when D already holds the same constant
+- dead loads: instructions that only write A and/or D when that register is
+  overwritten before it is read
+
+Labels are barriers: nothing is assumed about A or D at a label, and both
+registers count as live there and at every jump. Reload elimination relies
+on the VM memory model: stack / segment addresses computed from SP, LCL,
+ARG, THIS or THAT never alias RAM[0..4] themselves.
+"""
+import sys
+
+from code import Code
+from parser import Instruction, decode, clean_lines, A_INSTRUCTION, C_INSTRUCTION, L_INSTRUCTION
+
+# Pointer registers whose pointed-to addresses are assumed not to alias themselves
+POINTERS = frozenset({"SP", "LCL", "ARG", "THIS", "THAT", "R0", "R1", "R2", "R3", "R4"})
+
+# comp -> offset for A=M / A=M+1 / A=M-1
+_MEM_OFFSET = {"M": 0, "M+1": 1, "M-1": -1}
+
+
+def _validate(code: list[Instruction]) -> None:
+    """Raise the assembler's errors up front: the passes below look at dest/comp
+    by substring and would otherwise drop an invalid instruction silently."""
+    for ins in code:
+        if ins.kind == A_INSTRUCTION:
+            if ins.symbol.isdigit() and int(ins.symbol) > 32767:
+                raise ValueError(f"A constant out of range: {ins.symbol}")
+        elif ins.kind == C_INSTRUCTION:
+            Code.dest(ins.dest)
+            Code.comp(ins.comp)
+            Code.jump(ins.jump)
+
+
+def _forward(code: list[Instruction]) -> list[Instruction]:
+    """Drop loads that repeat what A/D already hold, and M=M+1 / M=M-1 pairs."""
+    out: list[Instruction] = []
+    a_state = None  # None | ("sym", X) | ("mem", X, k): A == RAM[X] + k
+    d_state = None  # None | ("sym", X): D == address/value of symbol X
+
+    i = 0
+    while i < len(code):
+        ins = code[i]
+        i += 1
+
+        if ins.kind == L_INSTRUCTION:
+            out.append(ins)
+            a_state = d_state = None
+            continue
+
+        if ins.kind == A_INSTRUCTION:
+            sym = ins.symbol
+            if a_state == ("sym", sym):
+                continue
+            # @X / A=M+k while A already holds RAM[X]+k
+            if (i < len(code) and a_state is not None and a_state[0] == "mem"
+                    and a_state[1] == sym):
+                nxt = code[i]
+                if (nxt.kind not in (A_INSTRUCTION, L_INSTRUCTION) and nxt.dest == "A"
+                        and not nxt.jump and _MEM_OFFSET.get(nxt.comp) == a_state[2]):
+                    i += 1
+                    continue
+            out.append(ins)
+            a_state = ("sym", sym)
+            continue
+
+        dest, comp, jump = ins.dest, ins.comp, ins.jump
+
+        # M=M+1 directly followed by M=M-1 (same A, nothing in between) is a no-op
+        if dest == "M" and not jump and comp in ("M+1", "M-1") and out:
+            prev = out[-1]
+            if (prev.kind not in (A_INSTRUCTION, L_INSTRUCTION) and prev.dest == "M"
+                    and not prev.jump and {prev.comp, comp} == {"M+1", "M-1"}):
+                out.pop()
+                continue
+
+        # D=A while D already holds the same constant
+        if dest == "D" and comp == "A" and not jump and a_state is not None \
+                and a_state[0] == "sym" and d_state == a_state:
+            continue
+
+        out.append(ins)
+
+        if "D" in dest:
+            d_state = a_state if comp == "A" and a_state is not None and a_state[0] == "sym" else None
+        if "A" in dest:
+            if (a_state is not None and a_state[0] == "sym" and a_state[1] in POINTERS
+                    and comp in _MEM_OFFSET):
+                # AM=M-1 etc. write the new RAM[X] into A as well
+                a_state = ("mem", a_state[1], 0 if "M" in dest else _MEM_OFFSET[comp])
+            elif (a_state is not None and a_state[0] == "mem" and comp in ("A+1", "A-1")
+                    and "M" not in dest):
+                a_state = ("mem", a_state[1], a_state[2] + (1 if comp == "A+1" else -1))
+            else:
+                a_state = None
+    return out
+
+
+def _backward(code: list[Instruction]) -> list[Instruction]:
+    """Drop instructions whose only effect is a write to a dead A or D."""
+    keep: list[Instruction] = []
+    a_live = d_live = True  # unknown code follows the end of the program
+    for ins in reversed(code):
+        if ins.kind == L_INSTRUCTION:
+            keep.append(ins)
+            a_live = d_live = True
+            continue
+
+        if ins.kind == A_INSTRUCTION:
+            if not a_live:
+                continue
+            keep.append(ins)
+            a_live = False
+            continue
+
+        dest, comp, jump = ins.dest, ins.comp, ins.jump
+        writes_a, writes_d, writes_m = "A" in dest, "D" in dest, "M" in dest
+        if not jump and not writes_m and not (writes_a and a_live) and not (writes_d and d_live):
+            continue
+
+        keep.append(ins)
+        if jump:
+            a_live = d_live = True
+        if writes_a:
+            a_live = False
+        if writes_d:
+            d_live = False
+        if "A" in comp or "M" in comp or writes_m or jump:
+            a_live = True
+        if "D" in comp:
+            d_live = True
+    keep.reverse()
+    return keep
+
+
+def optimize(lines) -> tuple[list[str], int]:
+    """Optimize assembly lines. Returns (optimized lines, instructions removed).
+
+    Comments and blank lines are dropped; labels are kept. Invalid
+    instructions raise ValueError, as they do in the assembler.
+    """
+    code = [decode(line) for line in clean_lines(lines)]
+    _validate(code)
+    before = len(code)
+    while True:
+        size = len(code)
+        code = _backward(_forward(code))
+        if len(code) == size:
+            break
+    return [ins.text for ins in code], before - len(code)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python3 peephole.py Prog.asm [Out.asm]")
+        sys.exit(1)
+
+    asm_path = sys.argv[1]
+    out_path = sys.argv[2] if len(sys.argv) > 2 else asm_path.replace(".asm", ".opt.asm")
+    with open(asm_path, "r", encoding="utf-8") as f:
+        lines, removed = optimize(f)
+    with open(out_path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line + "\n")
+
+    print(f"Removed {removed} instructions")
+    print("Wrote", out_path)
+
+
+if __name__ == "__main__":
+    main()
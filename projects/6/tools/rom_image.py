@@ -0,0 +1,56 @@
+# ROMイメージ (.hack / パック済みバイナリ) の書き出し。
+# ローカルモジュールを import しないので、VM translator の --hack からもパス指定で読み込める。
+import os
+import sys
+from array import array
+from collections.abc import Iterable
+from itertools import islice
+
+# write_packed() が1回の tofile() で書き出す語数
+PACK_CHUNK_WORDS = 1 << 14
+
+def to_words(machine_codes: Iterable[str]) -> array:
+    """16bit文字列の列を array('H') (1語=2バイト) に詰める。"""
+    return array("H", [int(code, 2) for code in machine_codes])
+
+def write_hack(machine_codes: Iterable[str], hack_path: str) -> None:
+    """ASCII の .hack (1行1語) を書き出す。イテレータを渡せば逐次書き出しになる。
+
+    途中で例外が出ても中途半端な .hack が残らないよう、一時ファイルに書いてから置き換える。
+    """
+    tmp_path = hack_path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for code in machine_codes:
+                f.write(code + "\n")
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, hack_path)
+
+def write_packed(words: Iterable[int], bin_path: str, byteorder: str = "little") -> None:
+    """ROMイメージをバイナリで書き出す (1語2バイト、ヘッダなし)。
+
+    byteorder は "little" / "big"。エミュレータ側はそのまま mmap して読める。
+    words は array('H') でもイテレータでもよく、PACK_CHUNK_WORDS 語ずつ書き出す。
+    """
+    if byteorder not in ("little", "big"):
+        raise ValueError(f"byteorder must be 'little' or 'big': {byteorder}")
+    swap = byteorder != sys.byteorder
+    it = iter(words)
+    tmp_path = bin_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = array("H", islice(it, PACK_CHUNK_WORDS))
+                if not chunk:
+                    break
+                if chunk.itemsize != 2:
+                    raise RuntimeError(f"array('H') is not 16-bit on this platform: {chunk.itemsize}")
+                if swap:
+                    chunk.byteswap()
+                chunk.tofile(f)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, bin_path)
@@ -0,0 +1,141 @@
+"""Source map from ROM addresses back to the assembly (and VM) source.
+
+All tables are sorted arrays, so every lookup is an index or a binary search:
+
+- rom_asm_lines[addr]      -> .asm line that produced ROM word addr
+- label_addrs / label_names -> labels in ROM order (nearest label = last one <= addr)
+- function_addrs / function_names
+                           -> function entries only, from the function_asm_lines the
+                              VM translator writes, so internal labels such as
+                              EQ_END.Main.4 or Main.main$ret.3 do not hide the
+                              enclosing function
+- vm_asm_lines / vm_file_index / vm_lines
+                           -> first .asm line of each VM command and its .vm origin,
+                              as written by the VM translator (Prog.vmmap.json)
+
+.vm paths are kept relative to the directory of the .asm file.
+"""
+import json
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import NamedTuple
+
+from parser import decode, L_INSTRUCTION
+
+
+class SourceLocation(NamedTuple):
+    rom_address: int
+    asm_line: int
+    label: str | None
+    function: str | None
+    vm_file: str | None
+    vm_line: int | None
+
+
+def default_map_path(asm_path: str) -> str:
+    return os.path.splitext(asm_path)[0] + ".srcmap.json"
+
+
+def default_vmmap_path(asm_path: str) -> str:
+    return os.path.splitext(asm_path)[0] + ".vmmap.json"
+
+
+class SourceMap:
+    def __init__(self, asm: str, rom_asm_lines, label_addrs, label_names,
+                 vm_files=(), vm_asm_lines=(), vm_file_index=(), vm_lines=(),
+                 function_addrs=(), function_names=()):
+        self.asm = asm
+        self.rom_asm_lines = array("I", rom_asm_lines)
+        self.label_addrs = array("I", label_addrs)
+        self.label_names = list(label_names)
+        self.function_addrs = array("I", function_addrs)
+        self.function_names = list(function_names)
+        self.vm_files = list(vm_files)
+        self.vm_asm_lines = array("I", vm_asm_lines)
+        self.vm_file_index = array("i", vm_file_index)
+        self.vm_lines = array("I", vm_lines)
+
+    @classmethod
+    def build(cls, asm_path: str, vmmap_path: str | None = None) -> "SourceMap":
+        """Scan asm_path once. vmmap_path (if it exists) adds the VM origins."""
+        rom_asm_lines = array("I")
+        label_addrs = array("I")
+        label_names = []
+        with open(asm_path, "r", encoding="utf-8") as f:
+            for lineno, raw in enumerate(f, 1):
+                line = raw.split("//", 1)[0].strip()
+                if not line:
+                    continue
+                ins = decode(line)
+                if ins.kind == L_INSTRUCTION:
+                    label_addrs.append(len(rom_asm_lines))
+                    label_names.append(ins.symbol)
+                else:
+                    rom_asm_lines.append(lineno)
+
+        vm = {}
+        if vmmap_path is None:
+            vmmap_path = default_vmmap_path(asm_path)
+        if os.path.exists(vmmap_path):
+            with open(vmmap_path, "r", encoding="utf-8") as f:
+                vm = json.load(f)
+
+        # .vm paths: relative to the vmmap -> relative to the .asm
+        vmmap_dir = os.path.dirname(os.path.abspath(vmmap_path))
+        asm_dir = os.path.dirname(os.path.abspath(asm_path))
+        vm_files = [os.path.relpath(os.path.join(vmmap_dir, path), asm_dir)
+                    for path in vm.get("vm_files", ())]
+        # a function's entry label binds to the first instruction after its asm line
+        function_addrs = [bisect_left(rom_asm_lines, asm_line)
+                          for asm_line in vm.get("function_asm_lines", ())]
+
+        return cls(os.path.basename(asm_path), rom_asm_lines, label_addrs, label_names,
+                   vm_files, vm.get("asm_lines", ()),
+                   vm.get("file_index", ()), vm.get("vm_lines", ()),
+                   function_addrs, vm.get("function_names", ()))
+
+    def lookup(self, rom_address: int) -> SourceLocation:
+        if not (0 <= rom_address < len(self.rom_asm_lines)):
+            raise IndexError(f"ROM address out of range: {rom_address}")
+        asm_line = self.rom_asm_lines[rom_address]
+
+        i = bisect_right(self.label_addrs, rom_address) - 1
+        label = self.label_names[i] if i >= 0 else None
+
+        k = bisect_right(self.function_addrs, rom_address) - 1
+        function = self.function_names[k] if k >= 0 else None
+
+        vm_file = vm_line = None
+        j = bisect_right(self.vm_asm_lines, asm_line) - 1
+        if j >= 0 and self.vm_file_index[j] >= 0:
+            vm_file = self.vm_files[self.vm_file_index[j]]
+            vm_line = self.vm_lines[j]
+
+        return SourceLocation(rom_address, asm_line, label, function, vm_file, vm_line)
+
+    def __len__(self) -> int:
+        return len(self.rom_asm_lines)
+
+    def save(self, map_path: str) -> None:
+        with open(map_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "asm": self.asm,
+                "rom_asm_lines": self.rom_asm_lines.tolist(),
+                "label_addrs": self.label_addrs.tolist(),
+                "label_names": self.label_names,
+                "vm_files": self.vm_files,
+                "vm_asm_lines": self.vm_asm_lines.tolist(),
+                "vm_file_index": self.vm_file_index.tolist(),
+                "vm_lines": self.vm_lines.tolist(),
+                "function_addrs": self.function_addrs.tolist(),
+                "function_names": self.function_names,
+            }, f)
+
+    @classmethod
+    def load(cls, map_path: str) -> "SourceMap":
+        with open(map_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["asm"], data["rom_asm_lines"], data["label_addrs"], data["label_names"],
+                   data["vm_files"], data["vm_asm_lines"], data["vm_file_index"], data["vm_lines"],
+                   data.get("function_addrs", ()), data.get("function_names", ()))
@@ -0,0 +1,182 @@
+# test_assembler.py
+#
+# python -m pytest projects/6/tools  (または、このディレクトリで python -m unittest)
+#
+# アセンブラは CLI (サブプロセス) で動かす。projects/8/tools にも parser モジュールが
+# あるので、同じプロセスで両方のテストを import すると衝突するため。
+
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+TOOLS = Path(__file__).resolve().parent
+PROJECTS = TOOLS.parents[1]
+ASSEMBLER = TOOLS / "assembler.py"
+VM_TRANSLATOR = PROJECTS / "8" / "tools" / "vm_translator.py"
+
+# 手書きの小さなプログラム: 前方参照・後方参照・変数の初出順・定義済みシンボル・コメント
+SOURCES = {
+    "Symbols": """
+        // forward and backward references, variables in order of first use
+        @i
+        M=1
+        @sum
+        M=0
+    (LOOP)
+        @i
+        D=M
+        @100
+        D=D-A
+        @END      // forward
+        D;JGT
+        @i
+        D=M
+        @sum
+        M=D+M
+        @i
+        M=M+1
+        @LOOP     // backward
+        0;JMP
+    (END)
+        @END
+        0;JMP
+    """,
+    "Predefined": """
+        @SP
+        AM=M+1
+        @R15
+        M=D
+        @SCREEN
+        D=A
+        @KBD
+        D=D+A
+        @THAT
+        M=D
+        @later
+        M=-1
+        @32767
+        D=A
+        @0
+        M=D
+    (LAST)
+    """,
+}
+
+def run(*args) -> None:
+    subprocess.run([sys.executable, *map(str, args)], check=True, capture_output=True)
+
+def assemble(asm_path: Path, *flags: str) -> bytes:
+    """asm_path をアセンブルし、.hack の内容を返す。"""
+    run(ASSEMBLER, asm_path, *flags)
+    return asm_path.with_suffix(".hack").read_bytes()
+
+_references: dict[str, bytes] = {}
+
+def reference(asm_path: Path) -> bytes:
+    """2パス版 (基準) の出力。同じソースについては1回だけアセンブルする。"""
+    source = asm_path.read_text(encoding="utf-8")
+    if source not in _references:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "Reference.asm"
+            path.write_text(source, encoding="utf-8")
+            _references[source] = assemble(path)
+    return _references[source]
+
+class AssemblerTestCase(unittest.TestCase):
+    """一時ディレクトリに手書きのプログラムと、projects/7, 8 の VM テストを
+    VM translator で変換した .asm を用意する (モジュール全体で1回だけ)。"""
+
+    tmp: Path
+    programs: list[Path]
+
+    @classmethod
+    def setUpClass(cls):
+        if hasattr(AssemblerTestCase, "programs"):
+            return
+        tmp = tempfile.TemporaryDirectory()
+        unittest.addModuleCleanup(tmp.cleanup)
+        AssemblerTestCase.tmp = Path(tmp.name)
+        AssemblerTestCase.programs = programs = []
+        for name, source in SOURCES.items():
+            path = AssemblerTestCase.tmp / f"{name}.asm"
+            path.write_text(source, encoding="utf-8")
+            programs.append(path)
+
+        dirs = sorted({vm.parent for project in ("7", "8") for vm in (PROJECTS / project).rglob("*.vm")})
+        for options in ([], ["--shared-calls", "--compare", "shared"]):
+            for vm_dir in dirs:
+                name = vm_dir.name + ("Shared" if options else "")
+                shutil.copytree(vm_dir, AssemblerTestCase.tmp / name)
+                run(VM_TRANSLATOR, AssemblerTestCase.tmp / name, *options)
+                programs.append(AssemblerTestCase.tmp / name / f"{name}.asm")
+
+class SinglePassTest(AssemblerTestCase):
+    def test_variables_and_forward_labels(self):
+        words = [int(line, 2) for line in assemble(self.tmp / "Symbols.asm", "--single-pass").split()]
+        self.assertEqual(words[0], 16)   # @i
+        self.assertEqual(words[2], 17)   # @sum
+        self.assertEqual(words[8], 18)   # @END (ROM address of (END))
+        self.assertEqual(words[16], 4)   # @LOOP
+
+    def test_same_as_two_pass(self):
+        for asm_path in self.programs:
+            with self.subTest(program=asm_path.stem):
+                self.assertEqual(assemble(asm_path, "--single-pass"), reference(asm_path))
+
+class IncrementalTest(AssemblerTestCase):
+    def copy(self, asm_path: Path) -> Path:
+        """キャッシュが他のテストと混ざらないよう、別ディレクトリにコピーする。"""
+        work = self.tmp / "incremental" / asm_path.parent.name
+        shutil.rmtree(work, ignore_errors=True)
+        work.mkdir(parents=True)
+        return Path(shutil.copy(asm_path, work))
+
+    def check(self, asm_path: Path) -> None:
+        """--incremental (今あるキャッシュを使う) と2パス版の出力が一致すること。"""
+        self.assertEqual(assemble(asm_path, "--incremental"), reference(asm_path))
+
+    def test_same_as_two_pass(self):
+        for asm_path in self.programs:
+            with self.subTest(program=asm_path.stem):
+                asm_path = self.copy(asm_path)
+                self.check(asm_path)   # キャッシュなし
+                self.assertTrue(asm_path.with_suffix(".asmcache").exists())
+                self.check(asm_path)   # キャッシュをすべて再利用
+
+    def test_edits_between_runs(self):
+        edits = [
+            # 先頭領域に命令を足す: 後ろのラベルがすべてずれる
+            lambda lines: lines[:1] + ["@7", "D=A"] + lines[1:],
+            # 新しい変数を先頭で使う: 変数の割り当て順が変わる
+            lambda lines: ["@first_var", "M=0"] + lines,
+            # ラベルを1つ消す: 以後そのシンボルは変数になる
+            lambda lines: [line for line in lines if line.strip() != "(END)"],
+            # 末尾の領域だけ変える
+            lambda lines: lines + ["(TAIL)", "@TAIL", "0;JMP"],
+            # 元に戻す
+            None,
+        ]
+        for asm_path in (self.tmp / "Symbols.asm", self.tmp / "FibonacciElement" / "FibonacciElement.asm"):
+            with self.subTest(program=asm_path.stem):
+                asm_path = self.copy(asm_path)
+                original = asm_path.read_text(encoding="utf-8").splitlines()
+                self.check(asm_path)
+                lines = original
+                for edit in edits:
+                    lines = edit(lines) if edit is not None else original
+                    asm_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+                    self.check(asm_path)
+
+    def test_broken_cache_is_ignored(self):
+        asm_path = self.copy(self.tmp / "Symbols.asm")
+        cache_path = asm_path.with_suffix(".asmcache")
+        for content in ("", "not json", "[]", '{"version": -1, "regions": {}}'):
+            with self.subTest(cache=content):
+                cache_path.write_text(content, encoding="utf-8")
+                self.check(asm_path)
+
+if __name__ == "__main__":
+    unittest.main()
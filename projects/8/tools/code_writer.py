@@ -1,9 +1,24 @@
 # code_writer.py
 
+import json
 import os
+from array import array
+from typing import NamedTuple
+
+class Fragment(NamedTuple):
+    """The translation of one .vm file, to be merged with CodeWriter.appendFragment()."""
+    lines: list[str]
+    routines: frozenset[str]
+    map_asm_lines: array      # source map entries, asm lines relative to the fragment
+    map_vm_lines: array
+    function_asm_lines: array # function entry labels, asm lines relative to the fragment
+    function_names: list[str]
 
 class CodeWriter:
     TEMP_BASE = 5
+    # local/argument/this/that indices up to this are addressed as
+    # A=M / A=M+1 / A=A+1... instead of base + index arithmetic
+    DIRECT_INDEX_MAX = 3
     SEG_BASE = {
         "local": "LCL",
         "argument": "ARG",
@@ -32,15 +47,97 @@ class CodeWriter:
         "gt": "D;JGT",
     }
 
-    def __init__(self, asm_path: str):
+    # negated conditions, for `cmp; not; if-goto`
+    _CMP_NOT_JUMP = {
+        "eq": "D;JNE",
+        "lt": "D;JGE",
+        "gt": "D;JLE",
+    }
+
+    # cache_top: binary / unary ops with the top of stack held in D
+    _BIN_OP_D = {
+        "add": "D=D+M",
+        "sub": "D=M-D",   # x - y  (x in M, y in D)
+        "and": "D=D&M",
+        "or":  "D=D|M",
+    }
+    _UNARY_OP_D = {
+        "neg": "D=-D",
+        "not": "D=!D",
+    }
+    _CONST_OP_D = {
+        "add": "D=D+A",
+        "sub": "D=D-A",
+        "and": "D=D&A",
+        "or":  "D=D|A",
+    }
+
+    # emitted lines are handed to the sink in chunks of this many lines
+    FLUSH_LINES = 8192
+
+    COMPARE_MODES = ("inline", "shared")
+    LOCAL_INIT_MODES = ("auto", "unrolled", "bump", "loop")
+
+    def __init__(self, asm_path: str | None, shared_calls: bool = False, compare_mode: str = "inline",
+                 cache_top: bool = False, local_init: str = "auto", sink=None,
+                 bootstrap: bool = True):
+        if compare_mode not in self.COMPARE_MODES:
+            raise ValueError(f"Unknown compare mode: {compare_mode}")
+        if local_init not in self.LOCAL_INIT_MODES:
+            raise ValueError(f"Unknown local init mode: {local_init}")
         self.asm_path = asm_path
-        self.out: list[str] = []
+        # shared_calls: every call/return jumps to one global $CALL/$RETURN routine
+        # instead of inlining ~45/~50 instructions (much smaller ROM, a few more cycles)
+        self.shared_calls = shared_calls
+        # compare_mode: "inline" expands eq/lt/gt in place (~22 instructions),
+        # "shared" jumps to one $EQ/$LT/$GT routine with the return address in R15
+        self.compare_mode = compare_mode
+        # cache_top: keep the top of stack in D instead of RAM where possible;
+        # _d_top is True while it lives there (RAM[SP] not yet written, SP not bumped).
+        # It is flushed before labels, jumps, calls, function entry and return,
+        # so every label is reached with the whole stack in RAM.
+        self.cache_top = cache_top
+        self._d_top = False
+        # local_init: how writeFunction zeroes the locals ("auto": see _choose_local_init)
+        self.local_init = local_init
+        self._routines_used: set[str] = set()
+
+        # output: lines are buffered and passed to sink(lines) in chunks of
+        # FLUSH_LINES (and at close()). Without a sink they stream to asm_path
+        # through a temporary file (opened on the first chunk) that replaces
+        # asm_path on close() or is deleted by abort(), or, if asm_path is None,
+        # are kept in memory for fragment().
+        self._buf: list[str] = []
+        self._flushed = 0  # lines already handed to the sink
+        self._to_file = sink is None and asm_path is not None
+        self._file = None
+        self._collected: list[str] = []
+        if sink is None and asm_path is None:
+            sink = self._collected.extend
+        elif sink is None:
+            sink = self._write_chunk
+        self.sink = sink
+
         self.label_id = 0
         self.file_stem: str | None = None
         self.current_function = ""
         self.call_id = 0
+
+        # source map: the VM command that produced each run of asm lines,
+        # as parallel arrays sorted by asm line (-1 = no VM origin, e.g. bootstrap)
+        self.vm_files: list[str] = []
+        self._file_index = -1
+        self.map_asm_lines = array("I", [1])
+        self.map_file_index = array("i", [-1])
+        self.map_vm_lines = array("I", [0])
+        # function entries (the asm line of each function's label), so the
+        # assembler's source map can name the function around a ROM address
+        self.function_asm_lines = array("I")
+        self.function_names: list[str] = []
         
-        # bootstrap
+        # bootstrap (left out for writers that only build a Fragment)
+        if not bootstrap:
+            return
         self._emit_lines([
             "// Bootstrap",
             "@256",
@@ -51,19 +148,80 @@ class CodeWriter:
         
         self.writeCall("Sys.init", 0)
 
-    def _new_id(self) -> int:
+    def _new_id(self) -> str:
+        """Label suffix unique within the current file ("Stem.N")."""
         uid = self.label_id
         self.label_id += 1
-        return uid
+        return f"{self.file_stem}.{uid}" if self.file_stem else str(uid)
 
     def _emit(self, line: str) -> None:
-        self.out.append(line)
+        self._buf.append(line)
+        if len(self._buf) >= self.FLUSH_LINES:
+            self._flush()
 
     def _emit_lines(self, lines: list[str]) -> None:
-        self.out.extend(lines)
+        self._buf.extend(lines)
+        if len(self._buf) >= self.FLUSH_LINES:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._buf:
+            chunk = self._buf
+            self._buf = []
+            self._flushed += len(chunk)
+            self.sink(chunk)
+
+    def _write_chunk(self, lines: list[str]) -> None:
+        if self._file is None:
+            self._file = open(self.asm_path + ".tmp", "w", encoding="utf-8")
+        self._file.write("\n".join(lines) + "\n")
+
+    @property
+    def line_count(self) -> int:
+        """Number of asm lines emitted so far."""
+        return self._flushed + len(self._buf)
 
     def setFileName(self, vm_path: str) -> None:
+        self._flush_top()
         self.file_stem = os.path.splitext(os.path.basename(vm_path))[0]
+        self.vm_files.append(str(vm_path))
+        self._file_index = len(self.vm_files) - 1
+        # labels are file-scoped, so each file can be translated on its own
+        self.current_function = ""
+        self.label_id = 0
+        self.call_id = 0
+
+    def setSourceLine(self, vm_line: int) -> None:
+        """Attribute the asm lines emitted from now on to vm_line of the current file."""
+        self.map_asm_lines.append(self.line_count + 1)
+        self.map_file_index.append(self._file_index)
+        self.map_vm_lines.append(vm_line)
+
+    def _mark_no_origin(self) -> None:
+        """The asm lines emitted from now on do not come from any VM command."""
+        self.map_asm_lines.append(self.line_count + 1)
+        self.map_file_index.append(-1)
+        self.map_vm_lines.append(0)
+
+    def _mark_function(self, name: str) -> None:
+        """The next asm line is the entry label of function (or shared routine) name."""
+        self.function_asm_lines.append(self.line_count + 1)
+        self.function_names.append(name)
+
+    def writeSourceMap(self, map_path: str) -> None:
+        """Write the asm line -> (.vm file, line) map as a JSON sidecar.
+        The .vm paths are written relative to the directory of map_path."""
+        map_dir = os.path.dirname(os.path.abspath(map_path))
+        with open(map_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "asm": os.path.basename(self.asm_path or ""),
+                "vm_files": [os.path.relpath(os.path.abspath(path), map_dir) for path in self.vm_files],
+                "asm_lines": self.map_asm_lines.tolist(),
+                "file_index": self.map_file_index.tolist(),
+                "vm_lines": self.map_vm_lines.tolist(),
+                "function_asm_lines": self.function_asm_lines.tolist(),
+                "function_names": self.function_names,
+            }, f)
 
     # ---------- for functions/call ----------
     def _scoped_label(self, label: str) -> str:
@@ -71,8 +229,10 @@ class CodeWriter:
             return f"{self.current_function}${label}"
         return label
     
-    def _new_call_ret_label(self, function_name: str) -> str:
-        label = f"{function_name}$ret.{self.call_id}"
+    def _new_call_ret_label(self) -> str:
+        # Caller$ret.N, N counted per file (Bootstrap$ret.0 for the Sys.init call)
+        scope = self.current_function or self.file_stem or "Bootstrap"
+        label = f"{scope}$ret.{self.call_id}"
         self.call_id += 1
         return label
     
@@ -94,6 +254,22 @@ class CodeWriter:
             "D=M",
         ])
 
+    def _flush_top(self) -> None:
+        """Write a top of stack cached in D back to RAM."""
+        if self._d_top:
+            self._d_top = False
+            self._push_D()
+
+    def _pop_to_D_cached(self) -> None:
+        """Make sure the top of stack is in D (popping it from RAM if needed)."""
+        if not self._d_top:
+            self._emit_lines([
+                "@SP",
+                "AM=M-1",
+                "D=M",
+            ])
+            self._d_top = True
+
     def _top_to_D(self) -> None:
         """D = *SP (top element) without popping."""
         self._emit_lines([
@@ -120,21 +296,10 @@ class CodeWriter:
             "M=D",
         ])
 
-    def _push_from_R13_addr(self) -> None:
-        self._emit_lines([
-            "@R13",
-            "A=M",
-            "D=M",
-        ])
-        self._push_D()
-
-    def _pop_to_R13_addr(self) -> None:
-        self._pop_to_D()
-        self._emit_lines([
-            "@R13",
-            "A=M",
-            "M=D",
-        ])
+    def _segment_addr_to_A(self, base_sym: str, index: int) -> None:
+        """A = base + index by pointer arithmetic (index <= DIRECT_INDEX_MAX)."""
+        self._emit_lines([f"@{base_sym}", "A=M" if index == 0 else "A=M+1"])
+        self._emit_lines(["A=A+1"] * (index - 1))
 
     def _push_from_symbol(self, sym: str) -> None:
         self._emit_lines([f"@{sym}", "D=M"])
@@ -169,6 +334,10 @@ class CodeWriter:
         ])
 
     def _compare(self, jump_line: str, prefix: str) -> None:
+        if self.compare_mode == "shared":
+            self._shared_compare(prefix)
+            return
+
         uid = self._new_id()
         true_label = f"{prefix}_TRUE.{uid}"
         end_label  = f"{prefix}_END.{uid}"
@@ -199,7 +368,68 @@ class CodeWriter:
             "M=M+1",
         ])
     
+    def _shared_compare(self, prefix: str) -> None:
+        # R15 = return address; $EQ/$LT/$GT replace x, y with the result
+        routine = f"${prefix}"
+        ret_label = f"{prefix}_RET.{self._new_id()}"
+        self._routines_used.add(routine)
+        self._emit_lines([
+            f"// {prefix}",
+            f"@{ret_label}",
+            "D=A",
+            "@R15",
+            "M=D",
+            f"@{routine}",
+            "0;JMP",
+            f"({ret_label})",
+        ])
+
+    def _cached_arithmetic(self, command: str) -> bool:
+        """cache_top versions of writeArithmetic; leave the result in D.
+        Returns False if the in-memory version should be used instead."""
+        if command in self._BIN_OP_D:
+            self._emit(f"// {command.upper()}")
+            self._pop_to_D_cached()  # y
+            self._emit_lines([
+                "@SP",
+                "AM=M-1",
+                self._BIN_OP_D[command],
+            ])
+            return True
+
+        if command in self._UNARY_OP_D and self._d_top:
+            self._emit_lines([f"// {command.upper()}", self._UNARY_OP_D[command]])
+            return True
+
+        if command in self._CMP_JUMP and self.compare_mode == "inline":
+            prefix = command.upper()
+            uid = self._new_id()
+            true_label = f"{prefix}_TRUE.{uid}"
+            end_label  = f"{prefix}_END.{uid}"
+            self._emit(f"// {prefix}")
+            self._pop_to_D_cached()  # y
+            self._emit_lines([
+                "@SP",
+                "AM=M-1",
+                "D=M-D",      # x - y
+                f"@{true_label}",
+                self._CMP_JUMP[command],
+                "D=0",        # false
+                f"@{end_label}",
+                "0;JMP",
+                f"({true_label})",
+                "D=-1",       # true
+                f"({end_label})",
+            ])
+            return True
+
+        return False
+
     def writeArithmetic(self, command: str) -> None:
+        if self.cache_top and self._cached_arithmetic(command):
+            return
+        self._flush_top()
+
         # 1) binary ops
         if command in self._BIN_OP:
             self._binary_op(self._BIN_OP[command], comment=command.upper())
@@ -221,6 +451,17 @@ class CodeWriter:
         if command not in ("push", "pop"):
             raise ValueError(f"Unknown command: {command}")
 
+        if self.cache_top and command == "push":
+            self._flush_top()
+            self._emit(f"// push {segment} {index}")
+            self._load_to_D(segment, index)
+            self._d_top = True
+            return
+
+        if self._d_top:
+            self._pop_cached(segment, index)
+            return
+
         # 1) constant
         if segment == "constant":
             if command != "push":
@@ -231,59 +472,163 @@ class CodeWriter:
 
         # 2) local/argument/this/that (base + index)
         if segment in self.SEG_BASE:
-            base_sym = self.SEG_BASE[segment]
-            self._compute_base_plus_index_to_R13(base_sym, index)
             if command == "push":
-                self._push_from_R13_addr()
+                self._load_to_D(segment, index)
+                self._push_D()
             else:
-                self._pop_to_R13_addr()
+                self._pop_to_segment(self.SEG_BASE[segment], index)
             return
 
-        # 3) temp (direct address 5..12)
+        # 3) temp / pointer / static (direct address)
+        sym = self._segment_symbol(segment, index)
+        if command == "push":
+            self._push_from_symbol(sym)
+        else:
+            self._pop_to_symbol(sym)
+
+    def _segment_symbol(self, segment: str, index: int) -> str:
+        """Direct address symbol of temp/pointer/static segment entries."""
+        # temp (direct address 5..12)
         if segment == "temp":
             if not (0 <= index <= 7):
                 raise ValueError(f"temp index out of range: {index}")
-            addr = self.TEMP_BASE + index
-            sym = str(addr)
-            if command == "push":
-                self._push_from_symbol(sym)
-            else:
-                self._pop_to_symbol(sym)
-            return
+            return str(self.TEMP_BASE + index)
 
-        # 4) pointer (0->THIS, 1->THAT)
+        # pointer (0->THIS, 1->THAT)
         if segment == "pointer":
             if index == 0:
-                sym = "THIS"
-            elif index == 1:
-                sym = "THAT"
-            else:
-                raise ValueError(f"pointer index must be 0 or 1: {index}")
-
-            if command == "push":
-                self._push_from_symbol(sym)
-            else:
-                self._pop_to_symbol(sym)
-            return
+                return "THIS"
+            if index == 1:
+                return "THAT"
+            raise ValueError(f"pointer index must be 0 or 1: {index}")
 
-        # 5) static (FileName.index)
+        # static (FileName.index)
         if segment == "static":
             if self.file_stem is None:
                 raise RuntimeError("setFileName() must be called before using static segment")
-            sym = f"{self.file_stem}.{index}"
+            return f"{self.file_stem}.{index}"
 
-            if command == "push":
-                self._push_from_symbol(sym)
-            else:
-                self._pop_to_symbol(sym)
+        raise ValueError(f"Unsupported segment: {segment}")
+
+    def _load_to_D(self, segment: str, index: int) -> None:
+        """D = segment[index] (no stack traffic)."""
+        if segment == "constant":
+            self._emit_lines([f"@{index}", "D=A"])
+        elif segment in self.SEG_BASE and index <= self.DIRECT_INDEX_MAX:
+            self._segment_addr_to_A(self.SEG_BASE[segment], index)
+            self._emit("D=M")
+        elif segment in self.SEG_BASE:
+            self._emit_lines([
+                f"@{self.SEG_BASE[segment]}",
+                "D=M",
+                f"@{index}",
+                "A=D+A",
+                "D=M",
+            ])
+        else:
+            self._emit_lines([f"@{self._segment_symbol(segment, index)}", "D=M"])
+
+    def _pop_to_segment(self, base_sym: str, index: int) -> None:
+        """pop into RAM[base + index] without spilling the address to R13."""
+        if index <= self.DIRECT_INDEX_MAX:
+            self._emit_lines([
+                "@SP",
+                "AM=M-1",
+                "D=M",
+            ])
+            self._segment_addr_to_A(base_sym, index)
+            self._emit("M=D")
             return
 
-        raise ValueError(f"Unsupported segment: {segment}")
+        self._emit_lines([
+            f"@{base_sym}",
+            "D=M",
+            f"@{index}",
+            "D=D+A",      # D = addr
+            "@SP",
+            "AM=M-1",
+            "D=D+M",      # D = addr + value
+            "A=D-M",      # A = addr
+            "M=D-A",      # RAM[addr] = value
+        ])
+
+    def _pop_cached(self, segment: str, index: int) -> None:
+        """pop with the value already in D."""
+        self._emit(f"// pop {segment} {index}")
+        if segment == "constant":
+            raise ValueError("constant supports only push")
+        if segment in self.SEG_BASE and index <= self.DIRECT_INDEX_MAX:
+            self._segment_addr_to_A(self.SEG_BASE[segment], index)
+            self._emit("M=D")
+        elif segment in self.SEG_BASE:
+            # park the value at RAM[SP] (free, SP is not bumped), then as _pop_to_segment
+            self._emit_lines([
+                "@SP",
+                "A=M",
+                "M=D",
+                f"@{self.SEG_BASE[segment]}",
+                "D=M",
+                f"@{index}",
+                "D=D+A",      # D = addr
+                "@SP",
+                "A=M",
+                "D=D+M",      # D = addr + value
+                "A=D-M",      # A = addr
+                "M=D-A",      # RAM[addr] = value
+            ])
+        else:
+            self._store_D_to_symbol(self._segment_symbol(segment, index))
+        self._d_top = False
+
+    def writeMove(self, src_segment: str, src_index: int, dst_segment: str, dst_index: int) -> None:
+        """`push src; pop dst` as a direct copy."""
+        self._flush_top()
+        self._emit(f"// push {src_segment} {src_index}; pop {dst_segment} {dst_index}")
+        if dst_segment == "constant":
+            raise ValueError("constant supports only push")
+        if dst_segment in self.SEG_BASE and dst_index <= self.DIRECT_INDEX_MAX:
+            self._load_to_D(src_segment, src_index)
+            self._segment_addr_to_A(self.SEG_BASE[dst_segment], dst_index)
+            self._emit("M=D")
+        elif dst_segment in self.SEG_BASE:
+            self._compute_base_plus_index_to_R13(self.SEG_BASE[dst_segment], dst_index)
+            self._load_to_D(src_segment, src_index)
+            self._emit_lines(["@R13", "A=M", "M=D"])
+        else:
+            sym = self._segment_symbol(dst_segment, dst_index)
+            self._load_to_D(src_segment, src_index)
+            self._store_D_to_symbol(sym)
+
+    def writeConstantOp(self, command: str, value: int) -> None:
+        """`push constant value; add/sub/and/or` applied to the top of the stack in place."""
+        if command not in self._BIN_OP:
+            raise ValueError(f"Unsupported arithmetic: {command}")
+        self._emit(f"// push constant {value}; {command}")
+        if command in ("add", "sub") and value == 0:
+            return
+        if self._d_top:
+            if command in ("add", "sub") and value == 1:
+                self._emit("D=D+1" if command == "add" else "D=D-1")
+            else:
+                self._emit_lines([f"@{value}", self._CONST_OP_D[command]])
+            return
+        if command in ("add", "sub") and value == 1:
+            self._emit_lines(["@SP", "A=M-1", "M=M+1" if command == "add" else "M=M-1"])
+            return
+        self._emit_lines([
+            f"@{value}",
+            "D=A",
+            "@SP",
+            "A=M-1",
+            self._BIN_OP[command],
+        ])
 
     def writeLabel(self, label: str) -> None:
+        self._flush_top()
         self._emit_lines([f"({self._scoped_label(label)}) // label"])
         
     def writeGoto(self, label: str) -> None:
+        self._flush_top()
         self._emit_lines([
             f"@{self._scoped_label(label)} // goto",
             "0;JMP",
@@ -291,30 +636,145 @@ class CodeWriter:
     
     def writeIf(self, label: str) -> None:
         self._emit("// if-goto")
-        self._pop_to_D()
+        if self._d_top:
+            self._d_top = False
+        else:
+            self._pop_to_D()
         self._emit_lines([
             f"@{self._scoped_label(label)}",
             "D;JNE",
         ])
         
+    def writeCompareIf(self, command: str, label: str, negate: bool = False) -> None:
+        """`eq/lt/gt; if-goto label` (or `eq/lt/gt; not; if-goto label` with negate)
+        as one conditional jump, without materializing the boolean."""
+        jumps = self._CMP_NOT_JUMP if negate else self._CMP_JUMP
+        if command not in jumps:
+            raise ValueError(f"Unsupported comparison: {command}")
+        if self._d_top:
+            # y is in D, only x is in RAM
+            self._d_top = False
+            self._emit_lines([
+                f"// {command}{'; not' if negate else ''}; if-goto {label}",
+                "@SP",
+                "AM=M-1",
+                "D=M-D",      # x - y
+                f"@{self._scoped_label(label)}",
+                jumps[command],
+            ])
+            return
+        self._emit_lines([
+            f"// {command}{'; not' if negate else ''}; if-goto {label}",
+            "@SP",
+            "AM=M-1",
+            "D=M",        # y
+            "A=A-1",
+            "D=M-D",      # x - y
+            "@SP",
+            "M=M-1",      # pop x
+            f"@{self._scoped_label(label)}",
+            jumps[command],
+        ])
+
     def writeFunction(self, function_name: str, n_locals: int) -> None:
+        self._flush_top()
         self.current_function = function_name
+        self._mark_function(function_name)
         self._emit_lines([f"({function_name}) // function {function_name}"])
-        for _ in range(n_locals):
-            self._emit_lines(["@0", "D=A"])
-            self._push_D()
+        if n_locals == 0:
+            return
+
+        strategy = self.local_init
+        if strategy == "auto":
+            strategy = self._choose_local_init(n_locals)
+
+        if strategy == "unrolled":
+            # push 0, n times
+            for _ in range(n_locals):
+                self._emit_lines([
+                    "@SP",
+                    "AM=M+1",
+                    "A=A-1",
+                    "M=0",
+                ])
+        elif strategy == "bump":
+            # zero LCL[0..n-1] by pointer, then SP += n
+            self._emit_lines(["@SP", "A=M", "M=0"])
+            for _ in range(n_locals - 1):
+                self._emit_lines(["A=A+1", "M=0"])
+            self._emit_lines(["D=A+1", "@SP", "M=D"])
+        else:
+            # D = n, R15 = return address; $LOCALS pushes n zeros
+            ret_label = f"LOCALS_RET.{self._new_id()}"
+            self._routines_used.add("$LOCALS")
+            self._emit_lines([
+                f"@{ret_label}",
+                "D=A",
+                "@R15",
+                "M=D",
+                f"@{n_locals}",
+                "D=A",
+                "@$LOCALS",
+                "0;JMP",
+                f"({ret_label})",
+            ])
+
+    @staticmethod
+    def local_init_cost(strategy: str, n_locals: int) -> tuple[int, int]:
+        """(ROM words, cycles) to zero n_locals locals with the given strategy.
+        The shared $LOCALS routine itself (10 words, once per program) is not counted."""
+        if n_locals == 0:
+            return 0, 0
+        if strategy == "unrolled":
+            return 4 * n_locals, 4 * n_locals
+        if strategy == "bump":
+            return 2 * n_locals + 4, 2 * n_locals + 4
+        if strategy == "loop":
+            return 8, 8 + 7 * n_locals + 3
+        raise ValueError(f"Unknown local init mode: {strategy}")
+
+    def _choose_local_init(self, n_locals: int) -> str:
+        """Cheapest strategy for n_locals. When shared calls or shared compares
+        were asked for, ROM size decides first; otherwise cycles do."""
+        prefer_rom = self.shared_calls or self.compare_mode == "shared"
+
+        def key(strategy: str) -> tuple[int, int]:
+            rom, cycles = self.local_init_cost(strategy, n_locals)
+            return (rom, cycles) if prefer_rom else (cycles, rom)
+
+        return min(("unrolled", "bump", "loop"), key=key)
             
     def writeCall(self, function_name: str, n_args: int) -> None:
-        # 1) push return-address
-        ret_label = self._new_call_ret_label(function_name)
+        self._flush_top()
+        ret_label = self._new_call_ret_label()
         self._emit(f"// call {function_name} {n_args}")
+
+        if self.shared_calls:
+            # R13 = n_args, R14 = callee, D = return address; $CALL does the rest
+            self._routines_used.add("$CALL")
+            self._emit_lines([
+                f"@{n_args}",
+                "D=A",
+                "@R13",
+                "M=D",
+                f"@{function_name}",
+                "D=A",
+                "@R14",
+                "M=D",
+                f"@{ret_label}",
+                "D=A",
+                "@$CALL",
+                "0;JMP",
+                f"({ret_label})",
+            ])
+            return
+
+        # 1) push return-address
         self._emit_lines([f"@{ret_label}", "D=A"])
         self._push_D()
 
         # 2) push LCL, ARG, THIS, THAT
-        for sym in ("LCL", "ARG", "THIS", "THAT"):
-            self._emit_lines([f"@{sym} // push {sym}", "D=M"])
-            self._push_D()
+        self._push_frame()
 
         # 3) ARG = SP - 5 - n_args
         # D = SP
@@ -332,10 +792,28 @@ class CodeWriter:
 
         # 6) (return-address)
         self._emit_lines([f"({ret_label})"])
+
+    def _push_frame(self) -> None:
+        """push LCL, ARG, THIS, THAT (the caller's frame)."""
+        for sym in ("LCL", "ARG", "THIS", "THAT"):
+            self._emit_lines([f"@{sym} // push {sym}", "D=M"])
+            self._push_D()
     
     def writeReturn(self) -> None:
+        self._flush_top()
+        if self.shared_calls:
+            self._routines_used.add("$RETURN")
+            self._emit_lines([
+                "// return",
+                "@$RETURN",
+                "0;JMP",
+            ])
+            return
+
         self._emit("// return (R1: FRAME=LCL)")
-        
+        self._return_body()
+
+    def _return_body(self) -> None:
         # FRAME = LCL  (R13 = LCL)
         self._emit_lines([
             "@LCL",
@@ -428,7 +906,149 @@ class CodeWriter:
             "0;JMP",
         ])
     
+
+    # ---------- shared routines ----------
+    def _write_call_routine(self) -> None:
+        """$CALL: D = return address, R13 = n_args, R14 = callee address."""
+        self._emit_lines(["($CALL) // shared call routine"])
+        self._push_D()
+        self._push_frame()
+
+        # ARG = SP - 5 - n_args
+        self._emit_lines([
+            "@SP",
+            "D=M",
+            "@R13",
+            "D=D-M",
+            "@5",
+            "D=D-A",
+            "@ARG",
+            "M=D",
+        ])
+
+        # LCL = SP
+        self._emit_lines(["@SP", "D=M"])
+        self._store_D_to_symbol("LCL")
+
+        # goto callee
+        self._emit_lines([
+            "@R14",
+            "A=M",
+            "0;JMP",
+        ])
+
+    def _write_return_routine(self) -> None:
+        self._emit_lines(["($RETURN) // shared return routine"])
+        self._return_body()
+
+    def _write_compare_routine(self, prefix: str) -> None:
+        """$EQ/$LT/$GT: pop y, x; push -1 if x op y else 0; return to R15."""
+        true_label = f"${prefix}_TRUE"
+        self._emit_lines([
+            f"(${prefix}) // shared {prefix.lower()} routine",
+            "@SP",
+            "AM=M-1",
+            "D=M",        # y
+            "A=A-1",
+            "D=M-D",      # x - y
+            "M=-1",       # assume true
+            f"@{true_label}",
+            self._CMP_JUMP[prefix.lower()],
+            "@SP",
+            "A=M-1",
+            "M=0",        # false
+            f"({true_label})",
+            "@R15",
+            "A=M",
+            "0;JMP",
+        ])
+
+    def _write_locals_routine(self) -> None:
+        """$LOCALS: D = n_locals (> 0); push n zeros; return to R15."""
+        self._emit_lines([
+            "($LOCALS) // shared local initialization routine",
+            "($LOCALS_LOOP)",
+            "@SP",
+            "AM=M+1",
+            "A=A-1",
+            "M=0",
+            "D=D-1",
+            "@$LOCALS_LOOP",
+            "D;JGT",
+            "@R15",
+            "A=M",
+            "0;JMP",
+        ])
+
+    def _write_routines(self) -> None:
+        """Emit the shared routines that were used, once each, after the program."""
+        writers = {
+            "$CALL": self._write_call_routine,
+            "$RETURN": self._write_return_routine,
+            "$EQ": lambda: self._write_compare_routine("EQ"),
+            "$LT": lambda: self._write_compare_routine("LT"),
+            "$GT": lambda: self._write_compare_routine("GT"),
+            "$LOCALS": self._write_locals_routine,
+        }
+        if not self._routines_used:
+            return
+        # A program that runs off its last instruction (the tests without
+        # Sys.init) must stop here instead of running into the first routine.
+        # For the source map the guard and each routine are functions of their own.
+        self._mark_no_origin()
+        self._mark_function("$END")
+        self._emit_lines([
+            "($END) // end of program",
+            "@$END",
+            "0;JMP",
+        ])
+        for name in sorted(self._routines_used):
+            self._mark_no_origin()
+            self._mark_function(name)
+            writers[name]()
+
+    def fragment(self) -> Fragment:
+        """Everything emitted so far by a CodeWriter(None, bootstrap=False),
+        without the shared routines."""
+        self._flush_top()
+        self._flush()
+        return Fragment(
+            self._collected,
+            frozenset(self._routines_used),
+            self.map_asm_lines[1:],
+            self.map_vm_lines[1:],
+            array("I", self.function_asm_lines),
+            list(self.function_names),
+        )
+
+    def appendFragment(self, vm_path: str, fragment: Fragment) -> None:
+        """Append a file translated by another writer, as if translated here."""
+        self.setFileName(vm_path)
+        base = self.line_count
+        for asm_line, vm_line in zip(fragment.map_asm_lines, fragment.map_vm_lines):
+            self.map_asm_lines.append(base + asm_line)
+            self.map_file_index.append(self._file_index)
+            self.map_vm_lines.append(vm_line)
+        for asm_line, name in zip(fragment.function_asm_lines, fragment.function_names):
+            self.function_asm_lines.append(base + asm_line)
+            self.function_names.append(name)
+        self._emit_lines(fragment.lines)
+        self._routines_used |= fragment.routines
+
     def close(self) -> None:
-        with open(self.asm_path, "w", encoding="utf-8") as f:
-            for line in self.out:
-                f.write(line + "\n")
\ No newline at end of file
+        self._flush_top()
+        self._write_routines()
+        self._flush()
+        if self._to_file:
+            if self._file is None:
+                self._write_chunk([])
+            self._file.close()
+            self._file = None
+            os.replace(self.asm_path + ".tmp", self.asm_path)
+
+    def abort(self) -> None:
+        """Give up on the output: close and delete the temporary file, if any."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self.asm_path + ".tmp")
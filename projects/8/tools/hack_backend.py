@@ -0,0 +1,91 @@
+# hack_backend.py
+
+import importlib.util
+from array import array
+from pathlib import Path
+
+# Modules of the project 6 assembler, loaded by path under names of their own
+# (projects/6/tools has a parser.py of its own, and code.py would shadow the
+# stdlib "code" module). None of them imports another local module, so
+# neither sys.path nor sys.modules is touched.
+_ASSEMBLER_DIR = Path(__file__).resolve().parents[2] / "6" / "tools"
+
+def _load(module_name: str, filename: str):
+    spec = importlib.util.spec_from_file_location(module_name, _ASSEMBLER_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+_parser = _load("hack_asm_parser", "parser.py")
+_code = _load("hack_asm_code", "code.py")
+_symbol_table = _load("hack_asm_symbol_table", "symbol_table.py")
+_rom_image = _load("hack_asm_rom_image", "rom_image.py")
+
+class HackSink:
+    """CodeWriter sink that encodes each chunk of lines into Hack words as it
+    arrives, so neither the .asm text nor its lines are kept.
+
+    Labels are bound as they arrive; @symbols that are not known yet are
+    recorded as fixups and resolved in finish(), where the ones that never
+    became labels are allocated as variables from 16 in order of first use.
+    Lines are decoded and encoded with the project 6 assembler's parser and
+    Code module, once per distinct line text, so the words are the ones
+    assembler.py produces for the .asm.
+    """
+
+    def __init__(self):
+        self.words = array("H")
+        self.symbols = _symbol_table.SymbolTable()
+        self._fixups: list[tuple[int, str]] = []  # (index in words, symbol)
+        self._line_words: dict[str, int] = {}     # resolved line text -> word
+
+    def __call__(self, lines: list[str]) -> None:
+        words = self.words
+        st = self.symbols
+        line_words = self._line_words
+        for line in _parser.clean_lines(lines):
+            word = line_words.get(line)
+            if word is not None:
+                words.append(word)
+                continue
+
+            ins = _parser.decode(line)
+            if ins.kind == _parser.L_INSTRUCTION:
+                if not st.contains(ins.symbol):
+                    st.addEntry(ins.symbol, len(words))
+                continue
+
+            if ins.kind == _parser.A_INSTRUCTION:
+                sym = ins.symbol
+                if sym.isdigit():
+                    word = int(_code.to_a_instruction(int(sym)), 2)
+                elif st.contains(sym):
+                    # labels keep their first address, so this never changes
+                    word = st.getAddress(sym)
+                else:
+                    # forward label or variable: decided in finish()
+                    self._fixups.append((len(words), sym))
+                    words.append(0)
+                    continue
+            else:
+                word = int(_code.to_c_instruction(ins.dest, ins.comp, ins.jump), 2)
+            line_words[line] = word
+            words.append(word)
+
+    def finish(self) -> array:
+        """Resolve the remaining @symbols and return the ROM image."""
+        st = self.symbols
+        next_address = 16
+        for index, sym in self._fixups:
+            if not st.contains(sym):
+                st.addEntry(sym, next_address)
+                next_address += 1
+            self.words[index] = st.getAddress(sym)
+        self._fixups = []
+        return self.words
+
+def write_hack(words: array, hack_path: str) -> None:
+    """ASCII .hack, one 16-bit word per line (rom_image.write_hack)."""
+    _rom_image.write_hack((f"{word:016b}" for word in words), hack_path)
+
+write_packed = _rom_image.write_packed
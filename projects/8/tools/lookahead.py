@@ -0,0 +1,86 @@
+# lookahead.py
+
+from collections import deque
+
+from parser import Command, OP_ARITHMETIC, OP_PUSH, OP_POP, OP_IF
+
+class CommandWindow:
+    """Sliding window over a command stream: peek(k) looks k commands ahead
+    without consuming, advance(n) consumes n commands."""
+
+    def __init__(self, commands):
+        self._it = iter(commands)
+        self._buf: deque[Command] = deque()
+
+    def _fill(self, n: int) -> bool:
+        while len(self._buf) < n:
+            cmd = next(self._it, None)
+            if cmd is None:
+                return False
+            self._buf.append(cmd)
+        return True
+
+    def peek(self, k: int = 0) -> Command | None:
+        return self._buf[k] if self._fill(k + 1) else None
+
+    def advance(self, n: int = 1) -> None:
+        self._fill(n)
+        for _ in range(n):
+            self._buf.popleft()
+
+    def __bool__(self) -> bool:
+        return self._fill(1)
+
+# ---------- rewrite rules ----------
+# Each rule looks at the window from the current command. If it matches, it
+# writes code for all the commands it covers, consumes them and returns True.
+
+COMPARE_COMMANDS = ("eq", "lt", "gt")
+CONSTANT_OPS = ("add", "sub", "and", "or")
+
+def _is_arith(cmd: Command | None, *names: str) -> bool:
+    return cmd is not None and cmd.op == OP_ARITHMETIC and cmd.arg1 in names
+
+def fuse_compare_if(window: CommandWindow, writer) -> bool:
+    """eq/lt/gt; if-goto L  and  eq/lt/gt; not; if-goto L  -> one conditional jump."""
+    cmd = window.peek(0)
+    if not _is_arith(cmd, *COMPARE_COMMANDS):
+        return False
+    nxt = window.peek(1)
+    if nxt is not None and nxt.op == OP_IF:
+        writer.writeCompareIf(cmd.arg1, nxt.arg1)
+        window.advance(2)
+        return True
+    if _is_arith(nxt, "not"):
+        nxt2 = window.peek(2)
+        if nxt2 is not None and nxt2.op == OP_IF:
+            writer.writeCompareIf(cmd.arg1, nxt2.arg1, negate=True)
+            window.advance(3)
+            return True
+    return False
+
+def fold_constant_op(window: CommandWindow, writer) -> bool:
+    """push constant N; add/sub/and/or  -> apply N to the top of the stack in place."""
+    cmd = window.peek(0)
+    if cmd.op != OP_PUSH or cmd.arg1 != "constant":
+        return False
+    nxt = window.peek(1)
+    if not _is_arith(nxt, *CONSTANT_OPS):
+        return False
+    writer.writeConstantOp(nxt.arg1, cmd.arg2)
+    window.advance(2)
+    return True
+
+def direct_move(window: CommandWindow, writer) -> bool:
+    """push X; pop Y  -> copy X to Y without touching the stack."""
+    cmd = window.peek(0)
+    if cmd.op != OP_PUSH:
+        return False
+    nxt = window.peek(1)
+    if nxt is None or nxt.op != OP_POP:
+        return False
+    writer.writeMove(cmd.arg1, cmd.arg2, nxt.arg1, nxt.arg2)
+    window.advance(2)
+    return True
+
+REWRITES = (fuse_compare_if, fold_constant_op, direct_move)
@@ -1,5 +1,7 @@
 # parser.py
 
+import sys
+
 C_ARITHMETIC = "C_ARITHMETIC"
 C_PUSH = "C_PUSH"
 C_POP = "C_POP"
@@ -16,68 +18,110 @@ ARITHMETIC_COMMANDS = {
     "eq", "lt", "gt",
 }
 
+# integer opcodes (index into COMMAND_TYPES and the translator's dispatch table)
+OP_ARITHMETIC = 0
+OP_PUSH = 1
+OP_POP = 2
+OP_LABEL = 3
+OP_GOTO = 4
+OP_IF = 5
+OP_FUNCTION = 6
+OP_CALL = 7
+OP_RETURN = 8
+
+COMMAND_TYPES = (C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_CALL, C_RETURN)
+
+# first word -> opcode (arithmetic commands all map to OP_ARITHMETIC)
+_OPCODES = {
+    "push": OP_PUSH,
+    "pop": OP_POP,
+    "label": OP_LABEL,
+    "goto": OP_GOTO,
+    "if-goto": OP_IF,
+    "function": OP_FUNCTION,
+    "call": OP_CALL,
+    "return": OP_RETURN,
+}
+_OPCODES.update(dict.fromkeys(ARITHMETIC_COMMANDS, OP_ARITHMETIC))
+
+# number of arguments after the command word, by opcode
+_N_ARGS = (0, 2, 2, 1, 1, 1, 2, 2, 0)
+
+class Command:
+    """One decoded VM command.
+
+    op:   OP_* opcode
+    arg1: arithmetic command / segment / label / function name (interned), None for return
+    arg2: index / n_locals / n_args, None if the command has none
+    line: 1-based line in the .vm file
+    """
+    __slots__ = ("op", "arg1", "arg2", "line")
+
+    def __init__(self, op: int, arg1: str | None, arg2: int | None, line: int):
+        self.op = op
+        self.arg1 = arg1
+        self.arg2 = arg2
+        self.line = line
+
+    @property
+    def ctype(self) -> str:
+        return COMMAND_TYPES[self.op]
+
+    def __repr__(self) -> str:
+        return f"Command({self.ctype}, {self.arg1!r}, {self.arg2!r}, line={self.line})"
+
+def decode(line: str, lineno: int = 0) -> Command:
+    """Decode one comment-free, non-empty VM line."""
+    parts = line.split()
+    op = _OPCODES.get(parts[0])
+    if op is None:
+        raise ValueError(f"Unknown command at line {lineno}: {line}")
+    if len(parts) - 1 != _N_ARGS[op]:
+        raise ValueError(f"Wrong number of arguments at line {lineno}: {line}")
+
+    if op == OP_ARITHMETIC:
+        return Command(op, sys.intern(parts[0]), None, lineno)
+    if op == OP_RETURN:
+        return Command(op, None, None, lineno)
+    arg2 = int(parts[2]) if len(parts) > 2 else None
+    return Command(op, sys.intern(parts[1]), arg2, lineno)
+
 class Parser:
     def __init__(self, vm_path: str):
-        self.lines = []
+        # every line is decoded once, up front
+        self.commands: list[Command] = []
         with open(vm_path, "r", encoding="utf-8") as f:
-            for raw in f:
+            for lineno, raw in enumerate(f, 1):
                 line = raw.split("//", 1)[0].strip()
                 if line:
-                    self.lines.append(line)
-                    
+                    self.commands.append(decode(line, lineno))
+
         self.current_index = -1
-        self.current_line = ""
-    
+        self.current: Command | None = None
+
+    def __iter__(self):
+        return iter(self.commands)
+
     def hasMoreLines(self) -> bool:
-        return self.current_index + 1 < len(self.lines)
-    
+        return self.current_index + 1 < len(self.commands)
+
     def advance(self) -> None:
         self.current_index += 1
-        self.current_line = self.lines[self.current_index]
-    
+        self.current = self.commands[self.current_index]
+
+    def lineNumber(self) -> int:
+        """1-based line number of the current command in the .vm file."""
+        return self.current.line
+
     def commandType(self) -> str:
-        parts = self.current_line.split()
-        cmd = parts[0]
-        
-        if cmd in ARITHMETIC_COMMANDS:
-            return C_ARITHMETIC
-        elif cmd == "push":
-            return C_PUSH
-        elif cmd == "pop":
-            return C_POP
-        elif cmd == "label":
-            return C_LABEL
-        elif cmd == "goto":
-            return C_GOTO
-        elif cmd == "if-goto":
-            return C_IF
-        elif cmd == "function":
-            return C_FUNCTION
-        elif cmd == "call":
-            return C_CALL
-        elif cmd == "return":
-            return C_RETURN
-        
-        return ""
-    
-    def arg1(self) -> str:
-        parts = self.current_line.split()
-        ctype = self.commandType()
-        
-        if ctype == C_ARITHMETIC:
-            return parts[0]
-        elif ctype in (C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_CALL):
-            return parts[1]
-
-        raise RuntimeError(f"arg1() called on unknown type: {self.current_line}")
-        
-    def arg2(self) -> int:
-        ctype = self.commandType()
-        
-        if ctype not in (C_PUSH, C_POP, C_FUNCTION, C_CALL):
-            raise RuntimeError(f"arg2() called on invalid command: {self.current_line}")
-        
-        parts = self.current_line.split()
-        return int(parts[2])
+        return COMMAND_TYPES[self.current.op]
 
+    def arg1(self) -> str:
+        if self.current.op == OP_RETURN:
+            raise RuntimeError(f"arg1() called on return (line {self.current.line})")
+        return self.current.arg1
 
+    def arg2(self) -> int:
+        if self.current.arg2 is None:
+            raise RuntimeError(f"arg2() called on invalid command: {self.current!r}")
+        return self.current.arg2
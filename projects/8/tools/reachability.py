@@ -0,0 +1,54 @@
+# reachability.py
+
+from parser import OP_FUNCTION, OP_CALL
+
+ENTRY = "Sys.init"
+
+def call_graph(commands) -> dict[str, list[str]]:
+    """function name -> functions it calls, in order of first call.
+    Code before the first `function` is listed under ""."""
+    graph: dict[str, list[str]] = {"": []}
+    current = ""
+    for cmd in commands:
+        if cmd.op == OP_FUNCTION:
+            current = cmd.arg1
+            graph.setdefault(current, [])
+        elif cmd.op == OP_CALL and cmd.arg1 not in graph[current]:
+            graph[current].append(cmd.arg1)
+    return graph
+
+def merge_graphs(graphs) -> dict[str, list[str]]:
+    """One call graph for a whole program from per-file graphs."""
+    merged: dict[str, list[str]] = {}
+    for graph in graphs:
+        for name, callees in graph.items():
+            merged.setdefault(name, []).extend(callees)
+    return merged
+
+def reachable(graph: dict[str, list[str]], entry: str = ENTRY) -> set[str]:
+    """Names of the functions reachable from entry in graph."""
+    seen = set()
+    # code outside any function runs too
+    stack = [entry, *graph.get("", ())]
+    while stack:
+        name = stack.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        stack.extend(graph.get(name, ()))
+    return seen
+
+def reachable_functions(commands, entry: str = ENTRY) -> set[str]:
+    """Names of the functions reachable from entry through `call` commands."""
+    return reachable(call_graph(commands), entry)
+
+def drop_unreachable(commands, live: set[str]) -> list:
+    """commands without the bodies of functions not in live."""
+    out = []
+    keep = True
+    for cmd in commands:
+        if cmd.op == OP_FUNCTION:
+            keep = cmd.arg1 in live
+        if keep:
+            out.append(cmd)
+    return out
@@ -0,0 +1,140 @@
+# test_code_writer.py
+#
+# python -m pytest projects/8/tools  (or python -m unittest, from this directory)
+
+import os
+import tempfile
+import unittest
+
+from code_writer import CodeWriter
+from hack_backend import HackSink
+
+STRATEGIES = ("unrolled", "bump", "loop")
+SP_START = 256
+GARBAGE = 0x5A5A
+
+def run_hack(rom, ram: list[int], stop: int | None = None, max_cycles: int = 100_000,
+             start: int = 0) -> int:
+    """Run the Hack program from start until PC == stop (or, if stop is None,
+    for max_cycles cycles or until it runs off the ROM); return the cycle count."""
+    a = d = cycles = 0
+    pc = start
+    while pc != stop:
+        if cycles >= max_cycles:
+            if stop is None:
+                break
+            raise AssertionError(f"did not reach address {stop}")
+        if pc >= len(rom):
+            if stop is None:
+                break
+            raise AssertionError(f"ran off the end of the ROM before address {stop}")
+        ins = rom[pc]
+        cycles += 1
+        if not ins & 0x8000:
+            a = ins
+            pc += 1
+            continue
+        x, y = d, (ram[a & 0x7FFF] if ins & 0x1000 else a)
+        c = ins >> 6 & 0x3F
+        if c & 0x20: x = 0
+        if c & 0x10: x ^= 0xFFFF
+        if c & 0x08: y = 0
+        if c & 0x04: y ^= 0xFFFF
+        out = (x + y) & 0xFFFF if c & 0x02 else x & y
+        if c & 0x01: out ^= 0xFFFF
+        addr = a
+        if ins & 0x20: a = out
+        if ins & 0x10: d = out
+        if ins & 0x08: ram[addr & 0x7FFF] = out
+        value = out - 0x10000 if out & 0x8000 else out
+        if (ins & 4 and value < 0) or (ins & 2 and value == 0) or (ins & 1 and value > 0):
+            pc = a & 0x7FFF
+        else:
+            pc += 1
+    return cycles
+
+def function_lines(strategy: str, n_locals: int) -> list[str]:
+    writer = CodeWriter(None, bootstrap=False, local_init=strategy)
+    writer.setFileName("Test.vm")
+    writer.writeFunction("Test.f", n_locals)
+    return writer.fragment().lines
+
+def count_words(lines: list[str]) -> int:
+    words = 0
+    for line in lines:
+        line = line.split("//", 1)[0].strip()
+        if line and not line.startswith("("):
+            words += 1
+    return words
+
+class LocalInitTest(unittest.TestCase):
+    def test_cost_matches_emitted_words(self):
+        for strategy in STRATEGIES:
+            for n in range(8):
+                with self.subTest(strategy=strategy, n_locals=n):
+                    rom, _ = CodeWriter.local_init_cost(strategy, n)
+                    self.assertEqual(count_words(function_lines(strategy, n)), rom)
+
+    def test_zeroes_locals_and_advances_sp(self):
+        for strategy in STRATEGIES:
+            for n in range(8):
+                with self.subTest(strategy=strategy, n_locals=n):
+                    sink = HackSink()
+                    writer = CodeWriter(None, bootstrap=False, local_init=strategy, sink=sink)
+                    writer.setFileName("Test.vm")
+                    writer.writeFunction("Test.f", n)
+                    writer.close()
+                    rom = sink.finish()
+
+                    ram = [GARBAGE] * 32768
+                    ram[0] = SP_START
+                    # the end-of-program guard follows the function's words
+                    cycles = run_hack(rom, ram, count_words(function_lines(strategy, n)))
+
+                    self.assertEqual(ram[0], SP_START + n)
+                    self.assertEqual(ram[SP_START:SP_START + n], [0] * n)
+                    self.assertEqual(ram[SP_START + n], GARBAGE)
+                    self.assertEqual(cycles, CodeWriter.local_init_cost(strategy, n)[1])
+
+    def test_auto_picks_the_cheapest(self):
+        for shared_calls in (False, True):
+            writer = CodeWriter(None, bootstrap=False, shared_calls=shared_calls)
+            for n in range(1, 20):
+                with self.subTest(shared_calls=shared_calls, n_locals=n):
+                    costs = {s: CodeWriter.local_init_cost(s, n) for s in STRATEGIES}
+                    chosen = costs[writer._choose_local_init(n)]
+                    if shared_calls:
+                        self.assertEqual(chosen, min(costs.values()))
+                    else:
+                        self.assertEqual(chosen[::-1], min(c[::-1] for c in costs.values()))
+
+class OutputFileTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.asm_path = os.path.join(self.dir, "Prog.asm")
+
+    def test_close_replaces_asm(self):
+        writer = CodeWriter(self.asm_path)
+        writer.close()
+        self.assertEqual(os.listdir(self.dir), ["Prog.asm"])
+
+    def test_abort_before_first_chunk(self):
+        writer = CodeWriter(self.asm_path)
+        self.assertEqual(os.listdir(self.dir), [])
+        writer.abort()
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_abort_after_first_chunk(self):
+        writer = CodeWriter(self.asm_path)
+        writer.setFileName("Test.vm")
+        writer.writeFunction("Test.f", 0)
+        while writer.line_count <= CodeWriter.FLUSH_LINES:
+            writer.writePushPop("push", "constant", 1)
+        self.assertEqual(os.listdir(self.dir), ["Prog.asm.tmp"])
+        writer.abort()
+        self.assertEqual(os.listdir(self.dir), [])
+
+if __name__ == "__main__":
+    unittest.main()
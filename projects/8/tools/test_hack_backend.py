@@ -0,0 +1,61 @@
+# test_hack_backend.py
+#
+# python -m pytest projects/8/tools  (or python -m unittest, from this directory)
+
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+TOOLS = Path(__file__).resolve().parent
+PROJECTS = TOOLS.parents[1]
+ASSEMBLER = PROJECTS / "6" / "tools" / "assembler.py"
+VM_TRANSLATOR = TOOLS / "vm_translator.py"
+
+# the official test programs of projects 7 and 8, one directory each
+PROGRAMS = sorted({vm.parent for project in ("7", "8") for vm in (PROJECTS / project).rglob("*.vm")})
+
+OPTION_SETS = (
+    [],
+    ["--shared-calls", "--compare", "shared"],
+    ["--cache-top", "--local-init", "loop"],
+    ["--keep-dead", "--no-fuse", "--local-init", "bump"],
+)
+
+def run(*args) -> None:
+    subprocess.run([sys.executable, *map(str, args)], check=True, capture_output=True)
+
+class FusedBackendTest(unittest.TestCase):
+    """--hack / --packed write the same bytes as translating to .asm and running assembler.py."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+
+    def test_bit_identical_to_assembler(self):
+        for program in PROGRAMS:
+            for options in OPTION_SETS:
+                with self.subTest(program=program.name, options=options):
+                    work = self.tmp / program.name
+                    shutil.rmtree(work, ignore_errors=True)
+                    shutil.copytree(program, work)
+                    stem = work / program.name
+
+                    run(VM_TRANSLATOR, work, *options)
+                    run(ASSEMBLER, stem.with_suffix(".asm"))
+                    expected_hack = stem.with_suffix(".hack").read_bytes()
+                    run(ASSEMBLER, stem.with_suffix(".asm"), "--packed", "big")
+                    expected_bin = stem.with_suffix(".bin").read_bytes()
+                    stem.with_suffix(".asm").unlink()
+
+                    run(VM_TRANSLATOR, work, *options, "--hack")
+                    run(VM_TRANSLATOR, work, *options, "--packed", "big")
+                    self.assertFalse(stem.with_suffix(".asm").exists())
+                    self.assertEqual(stem.with_suffix(".hack").read_bytes(), expected_hack)
+                    self.assertEqual(stem.with_suffix(".bin").read_bytes(), expected_bin)
+
+if __name__ == "__main__":
+    unittest.main()
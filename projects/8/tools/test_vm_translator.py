@@ -0,0 +1,355 @@
+# test_vm_translator.py
+#
+# python -m pytest projects/8/tools  (or python -m unittest, from this directory)
+
+import json
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from code_writer import CodeWriter
+from hack_backend import HackSink
+from parser import (Parser, decode, C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF,
+                    C_FUNCTION, C_CALL, C_RETURN, OP_FUNCTION)
+from reachability import drop_unreachable, reachable_functions
+from test_code_writer import run_hack
+
+TOOLS = Path(__file__).resolve().parent
+PROJECTS = TOOLS.parents[1]
+VM_TRANSLATOR = TOOLS / "vm_translator.py"
+
+# the official CPU-emulator tests of projects 7 and 8 (the *VME.tst ones are for the VM emulator)
+OFFICIAL_TESTS = sorted(tst for project in ("7", "8") for tst in (PROJECTS / project).rglob("*.tst")
+                        if not tst.name.endswith("VME.tst"))
+
+def run(*args) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *map(str, args)], check=True, capture_output=True, text=True)
+
+def translate(target: Path, *options: str) -> Path:
+    """Run vm_translator on a .vm file or directory; return the .asm path."""
+    run(VM_TRANSLATOR, target, *options)
+    return target / f"{target.name}.asm" if target.is_dir() else target.with_suffix(".asm")
+
+def assemble(asm_path: Path):
+    """(ROM words, symbol table) of an .asm file."""
+    sink = HackSink()
+    sink(asm_path.read_text(encoding="utf-8").split("\n"))
+    return sink.finish(), sink.symbols
+
+def signed(word: int) -> int:
+    return word - 0x10000 if word & 0x8000 else word
+
+class VMTranslatorTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+
+    def copy_program(self, program: Path, name: str | None = None) -> Path:
+        work = self.tmp / (name or program.name)
+        shutil.rmtree(work, ignore_errors=True)
+        shutil.copytree(program, work)
+        return work
+
+    def run_official_test(self, tst: Path, *options: str) -> None:
+        """Translate and run tst's program the way the CPU emulator does and
+        compare the RAM cells of its .cmp file."""
+        work = self.copy_program(tst.parent)
+        # programs with a Sys.vm start at the bootstrap; the others are tested
+        # from their first command, with the stack set up by the .tst
+        has_sys = (work / "Sys.vm").exists()
+        target = work if has_sys else work / f"{tst.stem}.vm"
+        rom, symbols = assemble(translate(target, *options))
+        start = 0 if has_sys else symbols.getAddress("Bootstrap$ret.0")
+
+        script = re.sub(r"//.*", "", tst.read_text(encoding="utf-8"))
+        ram = [0] * 32768
+        for address, value in re.findall(r"set RAM\[(\d+)\]\s+(-?\d+)", script):
+            ram[int(address)] = int(value) & 0xFFFF
+        cycles = int(re.search(r"repeat (\d+)", script).group(1))
+        run_hack(rom, ram, max_cycles=cycles, start=start)
+
+        rows = [row for row in tst.with_suffix(".cmp").read_text(encoding="utf-8").splitlines() if row.strip()]
+        for header, values in zip(rows[::2], rows[1::2]):
+            for cell, value in zip(header.strip("|").split("|"), values.strip("|").split("|")):
+                address = int(re.search(r"\d+", cell).group())
+                self.assertEqual(signed(ram[address]), int(value), f"{tst.stem} RAM[{address}]")
+
+class OfficialTestsTest(VMTranslatorTestCase):
+    """The official tests pass in every code generation mode."""
+
+    OPTION_SETS = (
+        [],
+        ["--shared-calls"],
+        ["--compare", "shared"],
+        ["--shared-calls", "--compare", "shared", "--local-init", "loop"],
+        ["--keep-dead"],
+    )
+
+    def test_official_tests(self):
+        for options in self.OPTION_SETS:
+            for tst in OFFICIAL_TESTS:
+                with self.subTest(test=tst.stem, options=options):
+                    self.run_official_test(tst, *options)
+
+class SharedCallsTest(VMTranslatorTestCase):
+    def test_smaller_rom(self):
+        work = self.copy_program(PROJECTS / "8" / "FunctionCalls" / "FibonacciElement")
+        inline, _ = assemble(translate(work))
+        shared, _ = assemble(translate(work, "--shared-calls"))
+        self.assertLess(len(shared), len(inline))
+
+class EndOfProgramGuardTest(unittest.TestCase):
+    """Programs without Sys.init run off their last command; with shared
+    routines they must stop there instead of running into the routines."""
+
+    def translate_compare(self, compare_mode: str) -> list[str]:
+        writer = CodeWriter(None, bootstrap=False, compare_mode=compare_mode)
+        writer.setFileName("Test.vm")
+        writer.writePushPop("push", "constant", 7)
+        writer.writePushPop("push", "constant", 7)
+        writer.writeArithmetic("eq")
+        writer.close()
+        return writer.fragment().lines
+
+    def test_guard_before_routines(self):
+        lines = self.translate_compare("shared")
+        labels = [line.split()[0] for line in lines if line.startswith("($")]
+        self.assertEqual(labels[:2], ["($END)", "($EQ)"])
+
+    def test_no_guard_without_routines(self):
+        self.assertNotIn("($END) // end of program", self.translate_compare("inline"))
+
+    def test_runs_into_guard_not_routine(self):
+        sink = HackSink()
+        sink(self.translate_compare("shared"))
+        rom = sink.finish()
+        ram = [0] * 32768
+        ram[0] = 256
+        run_hack(rom, ram, max_cycles=1000)
+        self.assertEqual(ram[0], 257)
+        self.assertEqual(signed(ram[256]), -1)
+
+class ParserTest(VMTranslatorTestCase):
+    def test_decode(self):
+        cases = [
+            ("add", C_ARITHMETIC, "add", None),
+            ("push constant 7", C_PUSH, "constant", 7),
+            ("pop local 2", C_POP, "local", 2),
+            ("label LOOP", C_LABEL, "LOOP", None),
+            ("goto LOOP", C_GOTO, "LOOP", None),
+            ("if-goto END", C_IF, "END", None),
+            ("function Main.f 3", C_FUNCTION, "Main.f", 3),
+            ("call Main.f 2", C_CALL, "Main.f", 2),
+            ("return", C_RETURN, None, None),
+        ]
+        for line, ctype, arg1, arg2 in cases:
+            with self.subTest(line=line):
+                cmd = decode(line, 4)
+                self.assertEqual((cmd.ctype, cmd.arg1, cmd.arg2, cmd.line), (ctype, arg1, arg2, 4))
+
+    def test_decode_errors(self):
+        for line in ("bogus 3", "push constant", "add 1", "return 0", "call Main.f"):
+            with self.subTest(line=line):
+                with self.assertRaises(ValueError):
+                    decode(line, 1)
+
+    def test_commands_match_accessors(self):
+        # Parser.commands and the hasMoreLines/advance/commandType/arg1/arg2
+        # interface give the same commands, for every official .vm file
+        for vm_file in sorted(PROJECTS.glob("[78]/*/*/*.vm")):
+            with self.subTest(vm_file=vm_file.name):
+                parser = Parser(vm_file)
+                walked = []
+                while parser.hasMoreLines():
+                    parser.advance()
+                    ctype = parser.commandType()
+                    arg1 = parser.arg1() if ctype != C_RETURN else None
+                    arg2 = parser.arg2() if ctype in (C_PUSH, C_POP, C_FUNCTION, C_CALL) else None
+                    walked.append((ctype, arg1, arg2, parser.lineNumber()))
+                self.assertEqual(walked, [(cmd.ctype, cmd.arg1, cmd.arg2, cmd.line) for cmd in parser])
+
+    def test_comments_and_line_numbers(self):
+        vm_file = self.tmp / "Test.vm"
+        vm_file.write_text("// header\n\npush constant 1 // one\n   add\nreturn\n", encoding="utf-8")
+        parser = Parser(vm_file)
+        self.assertEqual([(cmd.ctype, cmd.line) for cmd in parser],
+                         [(C_PUSH, 3), (C_ARITHMETIC, 4), (C_RETURN, 5)])
+        parser.advance()
+        parser.advance()
+        with self.assertRaises(RuntimeError):
+            parser.arg2()   # add has no second argument
+        parser.advance()
+        with self.assertRaises(RuntimeError):
+            parser.arg1()   # nor does return have a first
+
+DEAD_CODE_PROGRAM = {
+    "Sys.vm": """
+        function Sys.init 0
+        call Main.main 0
+        pop temp 0
+        label HALT
+        goto HALT
+    """,
+    "Main.vm": """
+        function Main.main 0
+        push constant 3
+        call Main.double 1
+        return
+        function Main.double 0
+        push argument 0
+        push argument 0
+        add
+        return
+        function Main.unused 0
+        push constant 1
+        call Main.dead 1
+        return
+        function Main.dead 0
+        call Main.unused 0
+        return
+    """,
+}
+
+def parse(source: str) -> list:
+    lines = [line.strip() for line in source.splitlines() if line.strip()]
+    return [decode(line, lineno) for lineno, line in enumerate(lines, 1)]
+
+class DeadFunctionTest(VMTranslatorTestCase):
+    def test_reachable_functions(self):
+        commands = parse(DEAD_CODE_PROGRAM["Sys.vm"] + DEAD_CODE_PROGRAM["Main.vm"])
+        live = reachable_functions(commands)
+        self.assertEqual(live, {"Sys.init", "Main.main", "Main.double"})
+        kept = drop_unreachable(commands, live)
+        self.assertEqual([cmd.arg1 for cmd in kept if cmd.op == OP_FUNCTION],
+                         ["Sys.init", "Main.main", "Main.double"])
+
+    def test_code_outside_functions_is_an_entry(self):
+        commands = parse("""
+            call Boot.start 0
+            function Boot.start 0
+            return
+            function Boot.unused 0
+            return
+        """)
+        self.assertEqual(reachable_functions(commands), {"Sys.init", "Boot.start"})
+
+    def write_program(self) -> Path:
+        work = self.tmp / "Dead"
+        work.mkdir()
+        for name, source in DEAD_CODE_PROGRAM.items():
+            (work / name).write_text(source, encoding="utf-8")
+        return work
+
+    def test_translator_drops_dead_functions(self):
+        work = self.write_program()
+        result = run(VM_TRANSLATOR, work)
+        self.assertIn("Removed 2 unreachable functions", result.stdout)
+        asm = (work / "Dead.asm").read_text(encoding="utf-8")
+        self.assertIn("(Main.double)", asm)
+        self.assertNotIn("(Main.unused)", asm)
+        self.assertNotIn("(Main.dead)", asm)
+        dropped, _ = assemble(work / "Dead.asm")
+
+        run(VM_TRANSLATOR, work, "--keep-dead")
+        self.assertIn("(Main.unused)", (work / "Dead.asm").read_text(encoding="utf-8"))
+        kept, _ = assemble(work / "Dead.asm")
+        self.assertLess(len(dropped), len(kept))
+
+        for rom in (dropped, kept):
+            ram = [0] * 32768
+            run_hack(rom, ram, max_cycles=2000)
+            self.assertEqual(ram[5], 6)   # temp 0 = Main.double(3)
+
+    def test_no_entry_point_keeps_everything(self):
+        work = self.copy_program(PROJECTS / "8" / "FunctionCalls" / "SimpleFunction")
+        asm = translate(work / "SimpleFunction.vm").read_text(encoding="utf-8")
+        self.assertIn("(SimpleFunction.test)", asm)
+
+class ParallelTranslationTest(VMTranslatorTestCase):
+    OPTION_SETS = (
+        [],
+        ["--shared-calls", "--compare", "shared", "--cache-top"],
+        ["--keep-dead", "--no-fuse"],
+    )
+
+    def multi_file_programs(self) -> list[Path]:
+        programs = [self.copy_program(PROJECTS / "8" / "FunctionCalls" / name)
+                    for name in ("FibonacciElement", "StaticsTest")]
+        # more files than workers: StaticsTest's classes, renamed
+        work = self.copy_program(PROJECTS / "8" / "FunctionCalls" / "StaticsTest", "ManyClasses")
+        source = (work / "Class1.vm").read_text(encoding="utf-8")
+        for i in range(3, 10):
+            (work / f"Class{i}.vm").write_text(source.replace("Class1", f"Class{i}"), encoding="utf-8")
+        programs.append(work)
+        return programs
+
+    def test_same_as_serial(self):
+        for work in self.multi_file_programs():
+            for options in self.OPTION_SETS:
+                with self.subTest(program=work.name, options=options):
+                    asm_path = translate(work, *options, "--source-map")
+                    map_path = asm_path.with_suffix(".vmmap.json")
+                    expected = asm_path.read_bytes(), map_path.read_bytes()
+                    translate(work, *options, "--source-map", "-j", "3")
+                    self.assertEqual((asm_path.read_bytes(), map_path.read_bytes()), expected)
+
+class TranslationCacheTest(VMTranslatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.work = self.copy_program(PROJECTS / "8" / "FunctionCalls" / "StaticsTest")
+        self.cache_path = self.work / "StaticsTest.vmcache"
+
+    def translate_cached(self, *options: str) -> int:
+        """Translate self.work with --cache; check the output against a
+        translation without the cache and return how many files were reused."""
+        result = run(VM_TRANSLATOR, self.work, "--cache", "--source-map", *options)
+        reference = self.copy_program(self.work, "Reference")
+        for path in reference.glob("*.vmcache"):
+            path.unlink()
+        run(VM_TRANSLATOR, reference, "--source-map", *options)
+        for suffix in (".asm", ".vmmap.json"):
+            self.assertEqual((self.work / f"StaticsTest{suffix}").read_bytes(),
+                             (reference / f"Reference{suffix}").read_bytes().replace(b"Reference", b"StaticsTest"))
+        return int(re.search(r"Reused (\d+) of", result.stdout).group(1))
+
+    def test_reuse_and_edits(self):
+        self.assertEqual(self.translate_cached(), 0)
+        self.assertEqual(self.translate_cached(), 3)
+        with open(self.work / "Class2.vm", "a", encoding="utf-8") as f:
+            f.write("function Class2.extra 0\npush constant 9\nreturn\n")
+        self.assertEqual(self.translate_cached(), 2)
+        self.assertEqual(self.translate_cached(), 3)
+
+    def test_options_are_part_of_the_key(self):
+        self.translate_cached()
+        self.assertEqual(self.translate_cached("--shared-calls"), 0)
+        self.assertEqual(self.translate_cached("--shared-calls"), 3)
+        self.assertEqual(self.translate_cached("--no-fuse"), 0)
+
+    def test_dead_set_is_part_of_the_key(self):
+        with open(self.work / "Class1.vm", "a", encoding="utf-8") as f:
+            f.write("function Class1.unused 0\npush constant 1\nreturn\n")
+        self.translate_cached()
+        # Class1.vm itself is unchanged, but Class1.unused becomes reachable
+        sys_vm = self.work / "Sys.vm"
+        sys_vm.write_text(sys_vm.read_text(encoding="utf-8").replace(
+            "function Sys.init 0", "function Sys.init 0\ncall Class1.unused 0\npop temp 1", 1), encoding="utf-8")
+        self.assertEqual(self.translate_cached(), 1)   # only Class2.vm is reused
+        self.assertIn("(Class1.unused)", (self.work / "StaticsTest.asm").read_text(encoding="utf-8"))
+
+    def test_unusable_cache_is_ignored(self):
+        self.translate_cached()
+        data = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        for content in ("", "not json", "[]", json.dumps(dict(data, version=-1)),
+                        json.dumps(dict(data, translator="another translator"))):
+            with self.subTest(cache=content[:40]):
+                self.cache_path.write_text(content, encoding="utf-8")
+                self.assertEqual(self.translate_cached(), 0)
+
+if __name__ == "__main__":
+    unittest.main()
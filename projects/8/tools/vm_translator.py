@@ -1,16 +1,197 @@
 # vm_translator.py
 
-from parser import Parser
-from code_writer import CodeWriter
-import sys
+from parser import Parser, OP_FUNCTION
+from code_writer import CodeWriter, Fragment
+from lookahead import CommandWindow, REWRITES
+from reachability import ENTRY, call_graph, merge_graphs, reachable, reachable_functions, drop_unreachable
+import argparse
+import hashlib
+import json
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+TRANSLATION_CACHE_VERSION = 1
+
+# sources whose changes can change the generated code
+_TRANSLATOR_SOURCES = ("parser.py", "code_writer.py", "lookahead.py", "reachability.py", "vm_translator.py")
+
+def dispatch_table(writer: CodeWriter) -> list:
+    """Command handlers indexed by opcode (parser.OP_*)."""
+    return [
+        lambda cmd: writer.writeArithmetic(cmd.arg1),                 # OP_ARITHMETIC
+        lambda cmd: writer.writePushPop("push", cmd.arg1, cmd.arg2),  # OP_PUSH
+        lambda cmd: writer.writePushPop("pop", cmd.arg1, cmd.arg2),   # OP_POP
+        lambda cmd: writer.writeLabel(cmd.arg1),                      # OP_LABEL
+        lambda cmd: writer.writeGoto(cmd.arg1),                       # OP_GOTO
+        lambda cmd: writer.writeIf(cmd.arg1),                         # OP_IF
+        lambda cmd: writer.writeFunction(cmd.arg1, cmd.arg2),         # OP_FUNCTION
+        lambda cmd: writer.writeCall(cmd.arg1, cmd.arg2),             # OP_CALL
+        lambda cmd: writer.writeReturn(),                             # OP_RETURN
+    ]
+
+def translate_commands(writer: CodeWriter, commands, fuse: bool = True) -> None:
+    """Translate one file's commands (after writer.setFileName())."""
+    rewrites = REWRITES if fuse else ()
+    handlers = dispatch_table(writer)
+    window = CommandWindow(commands)
+
+    while window:
+        cmd = window.peek()
+        writer.setSourceLine(cmd.line)
+        if any(rule(window, writer) for rule in rewrites):
+            continue
+        window.advance()
+        handlers[cmd.op](cmd)
+
+def translate_fragment(job) -> Fragment:
+    """Worker: translate one file on its own. Labels are file-scoped, so the
+    result is the same as translating it in sequence with the other files."""
+    vm_file, commands, options, fuse = job
+    writer = CodeWriter(None, bootstrap=False, **options)
+    writer.setFileName(vm_file)
+    translate_commands(writer, commands, fuse)
+    return writer.fragment()
+
+def _translate_fragments(jobs: list, n_workers: int) -> list[Fragment]:
+    if n_workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            return list(pool.map(translate_fragment, jobs))
+    return [translate_fragment(job) for job in jobs]
+
+def default_cache_path(asm_path: Path) -> Path:
+    return asm_path.with_suffix(".vmcache")
+
+def translator_fingerprint() -> str:
+    """Hash of the translator's own source, so a changed translator never reuses old output."""
+    h = hashlib.sha1()
+    for name in _TRANSLATOR_SOURCES:
+        h.update((Path(__file__).parent / name).read_bytes())
+    return h.hexdigest()
+
+def translate_cached(vm_files: list[Path], cache_path: Path, options: dict, fuse: bool = True,
+                     keep_dead: bool = False, n_workers: int = 1):
+    """Translate vm_files into fragments, reusing cached ones where possible.
+
+    Per file the cache keeps the content hash, the call graph and the fragment
+    with the key it was built for (content, options, functions dropped as
+    dead). Unchanged files are not even parsed: their call graph comes from
+    the cache too. Labels are file-scoped, so reused fragments need no
+    relocation. Returns (fragments in file order, dead function count, reused count).
+    """
+    data: dict = {}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        pass
+    fingerprint = translator_fingerprint()
+    if (not isinstance(data, dict) or data.get("version") != TRANSLATION_CACHE_VERSION
+            or data.get("translator") != fingerprint):
+        data = {}  # missing, broken or built by another translator version
+    cached: dict[str, dict] = data.get("files", {})
+
+    sources: dict[str, str] = {}
+    graphs: dict[str, dict] = {}
+    programs: dict[str, list] = {}
+    for vm_file in vm_files:
+        name = vm_file.name
+        sources[name] = hashlib.sha1(vm_file.read_bytes()).hexdigest()
+        entry = cached.get(name)
+        if entry is not None and entry["source"] == sources[name]:
+            graphs[name] = entry["graph"]
+        else:
+            programs[name] = Parser(vm_file).commands
+            graphs[name] = call_graph(programs[name])
+
+    defined = {f for graph in graphs.values() for f in graph if f}
+    live = None
+    if not keep_dead and ENTRY in defined:
+        live = reachable(merge_graphs(graphs.values()))
+
+    fragments: dict[str, Fragment] = {}
+    entries: dict[str, dict] = {}
+    jobs = []
+    for vm_file in vm_files:
+        name = vm_file.name
+        dead = sorted(f for f in graphs[name] if f and f not in live) if live is not None else []
+        key = hashlib.sha1(json.dumps([sources[name], options, fuse, dead], sort_keys=True)
+                           .encode("utf-8")).hexdigest()
+        entry = cached.get(name)
+        if entry is not None and entry["source"] == sources[name] and entry["key"] == key:
+            fragments[name] = Fragment(
+                entry["lines"].split("\n") if entry["lines"] else [],
+                frozenset(entry["routines"]),
+                array("I", entry["map_asm_lines"]),
+                array("I", entry["map_vm_lines"]),
+                array("I", entry["function_asm_lines"]),
+                entry["function_names"],
+            )
+            entries[name] = entry
+            continue
+
+        commands = programs.get(name)
+        if commands is None:
+            commands = Parser(vm_file).commands
+        if live is not None:
+            commands = drop_unreachable(commands, live)
+        jobs.append((vm_file, commands, options, fuse))
+        entries[name] = {"source": sources[name], "graph": graphs[name], "key": key}
+
+    for job, fragment in zip(jobs, _translate_fragments(jobs, n_workers)):
+        name = job[0].name
+        fragments[name] = fragment
+        entries[name].update({
+            "lines": "\n".join(fragment.lines),
+            "routines": sorted(fragment.routines),
+            "map_asm_lines": fragment.map_asm_lines.tolist(),
+            "map_vm_lines": fragment.map_vm_lines.tolist(),
+            "function_asm_lines": fragment.function_asm_lines.tolist(),
+            "function_names": fragment.function_names,
+        })
+
+    if jobs or entries.keys() != cached.keys():
+        with open(cache_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "version": TRANSLATION_CACHE_VERSION,
+                "translator": fingerprint,
+                "files": entries,
+            }))
+
+    n_dead = len(defined - live) if live is not None else 0
+    return [fragments[vm_file.name] for vm_file in vm_files], n_dead, len(vm_files) - len(jobs)
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 VMTranslator.py Prog.vm")
-        sys.exit(1)
+    ap = argparse.ArgumentParser(description="VM translator: Prog.vm or a directory -> Prog.asm")
+    ap.add_argument("in_path", help="input .vm file or directory of .vm files")
+    ap.add_argument("--source-map", action="store_true",
+                    help="also write Prog.vmmap.json mapping asm lines to .vm lines")
+    ap.add_argument("--shared-calls", action="store_true",
+                    help="use one shared call and return routine instead of inlining them")
+    ap.add_argument("--compare", choices=CodeWriter.COMPARE_MODES, default="inline",
+                    help="inline eq/lt/gt (faster) or jump to shared routines (smaller ROM)")
+    ap.add_argument("--cache-top", action="store_true",
+                    help="keep the top of stack in D between commands (fewer RAM accesses)")
+    ap.add_argument("--local-init", choices=CodeWriter.LOCAL_INIT_MODES, default="auto",
+                    help="how functions zero their locals (default: cheapest per function)")
+    ap.add_argument("--keep-dead", action="store_true",
+                    help="translate every function, even those not reachable from Sys.init")
+    ap.add_argument("--no-fuse", dest="fuse", action="store_false",
+                    help="do not rewrite command sequences (compare + if-goto, "
+                         "push constant + add/sub/and/or, push + pop)")
+    ap.add_argument("-j", "--jobs", type=int, default=1,
+                    help="translate the files of a directory in this many worker processes")
+    ap.add_argument("--cache", action="store_true",
+                    help="reuse the translation of unchanged .vm files from Prog.vmcache")
+    ap.add_argument("--hack", action="store_true",
+                    help="assemble in the same process and write Prog.hack instead of Prog.asm")
+    ap.add_argument("--packed", choices=("little", "big"),
+                    help="like --hack, but write a packed binary ROM image (Prog.bin)")
+    args = ap.parse_args()
+    if args.source_map and (args.hack or args.packed):
+        ap.error("--source-map needs the .asm output (not --hack / --packed)")
     
-    in_path = Path(sys.argv[1])
+    in_path = Path(args.in_path)
     
     if in_path.is_dir():
         vm_files = sorted(in_path.glob("*.vm"))       
@@ -22,57 +203,75 @@ def main():
     if not vm_files:
         raise RuntimeError("No .vm files found")
     
-    writer = CodeWriter(str(asm_path))
-    
-    for vm_file in vm_files:
-        writer.setFileName(vm_file)
-        parser = Parser(vm_file)
-    
-        while parser.hasMoreLines():
-            parser.advance()
-            ctype = parser.commandType()
-            
-            if ctype == "C_ARITHMETIC":
-                writer.writeArithmetic(parser.arg1())
-            
-            elif ctype == "C_PUSH":
-                writer.writePushPop(
-                    "push",
-                    parser.arg1(),
-                    parser.arg2()
-                )
-                
-            elif ctype == "C_POP":
-                writer.writePushPop(
-                    "pop",
-                    parser.arg1(),
-                    parser.arg2()
-                )
-            
-            elif ctype == "C_LABEL":
-                writer.writeLabel(parser.arg1())
-                
-            elif ctype == "C_GOTO":
-                writer.writeGoto(parser.arg1())
-            
-            elif ctype == "C_IF":
-                writer.writeIf(parser.arg1())
-            
-            elif ctype == "C_FUNCTION":
-                writer.writeFunction(parser.arg1(), parser.arg2())
-                
-            elif ctype == "C_CALL":
-                writer.writeCall(parser.arg1(), parser.arg2())
-                
-            elif ctype == "C_RETURN":
-                writer.writeReturn()
-                
+    options = {
+        "shared_calls": args.shared_calls,
+        "compare_mode": args.compare,
+        "cache_top": args.cache_top,
+        "local_init": args.local_init,
+    }
+    backend = None
+    if args.hack or args.packed:
+        # fused backend: the emitted lines go straight to the assembler, no .asm file
+        # (imported here: loading the project 6 assembler is only worth it for these)
+        from hack_backend import HackSink, write_hack, write_packed
+        backend = HackSink()
+        writer = CodeWriter(None, sink=backend, **options)
+    else:
+        writer = CodeWriter(str(asm_path), **options)
+
+    try:
+        if args.cache:
+            fragments, n_dead, reused = translate_cached(
+                vm_files, default_cache_path(asm_path), options, args.fuse, args.keep_dead, args.jobs)
+            if n_dead:
+                print(f"Removed {n_dead} unreachable functions")
+            print(f"Reused {reused} of {len(vm_files)} cached translations")
+            for vm_file, fragment in zip(vm_files, fragments):
+                writer.appendFragment(vm_file, fragment)
+        else:
+            programs = {vm_file: Parser(vm_file).commands for vm_file in vm_files}
+
+            # dead function elimination: only when the program has a Sys.init to start from
+            all_commands = [cmd for commands in programs.values() for cmd in commands]
+            defined = {cmd.arg1 for cmd in all_commands if cmd.op == OP_FUNCTION}
+            if not args.keep_dead and ENTRY in defined:
+                live = reachable_functions(all_commands)
+                programs = {vm_file: drop_unreachable(commands, live) for vm_file, commands in programs.items()}
+                dead = defined - live
+                if dead:
+                    print(f"Removed {len(dead)} unreachable functions")
+
+            if args.jobs > 1 and len(vm_files) > 1:
+                # per-file fragments in parallel, merged in file order behind the bootstrap
+                jobs = [(vm_file, programs[vm_file], options, args.fuse) for vm_file in vm_files]
+                fragments = _translate_fragments(jobs, args.jobs)
+                for vm_file, fragment in zip(vm_files, fragments):
+                    writer.appendFragment(vm_file, fragment)
             else:
-                raise ValueError(f"Unknown command type: {ctype}")
+                for vm_file in vm_files:
+                    writer.setFileName(vm_file)
+                    translate_commands(writer, programs[vm_file], args.fuse)
+
+        writer.close()
+    except BaseException:
+        # no half-written Prog.asm.tmp left behind
+        writer.abort()
+        raise
+    if backend is None:
+        print("Wrote", asm_path)
+    elif args.packed:
+        bin_path = asm_path.with_suffix(".bin")
+        write_packed(backend.finish(), str(bin_path), args.packed)
+        print("Wrote", bin_path)
+    else:
+        hack_path = asm_path.with_suffix(".hack")
+        write_hack(backend.finish(), str(hack_path))
+        print("Wrote", hack_path)
 
-    print("DEBUG out lines:", len(writer.out))
-    writer.close()
-    print("Wrote", asm_path)
+    if args.source_map:
+        map_path = asm_path.with_suffix(".vmmap.json")
+        writer.writeSourceMap(str(map_path))
+        print("Wrote", map_path)
         
 if __name__ == "__main__":
     main()
\ No newline at end of file